@@ -0,0 +1,166 @@
+"""Headless batch mesh export.
+
+Runs the vtkUtils surface pipeline for many brain/mask pairs without Qt or a
+display and writes the surfaces (one compressed .vtp each by default, see
+--format), the label statistics (labels.csv) and a timing report.
+
+    python3 batch_export.py SUBJECTS_DIR -o OUTPUT_DIR -j 16
+    python3 batch_export.py manifest.csv -o OUTPUT_DIR
+
+A directory input treats every sub-directory holding a brain and a mask file
+(see --brain / --mask) as one subject. A manifest is a CSV file with the
+columns subject, brain and mask, relative paths are resolved against the
+manifest's directory.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from vtkmodules.vtkCommonCore import vtkMultiThreader, vtkSMPTools
+
+import vtkUtils
+from config import *
+from meshExport import EXPORT_FORMATS, export_meshes
+from volumeIndex import pairing_problems, volume_index
+
+
+def find_subjects(input_path, brain_pattern, mask_pattern):
+    if os.path.isfile(input_path):
+        base_dir = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, newline='') as f:
+            return [(row['subject'], os.path.join(base_dir, row['brain']), os.path.join(base_dir, row['mask']))
+                    for row in csv.DictReader(f)]
+
+    subjects = []
+    for subject_dir in [input_path] + sorted(glob.glob(os.path.join(input_path, '*', ''))):
+        brains = sorted(glob.glob(os.path.join(subject_dir, brain_pattern)))
+        masks = sorted(glob.glob(os.path.join(subject_dir, mask_pattern)))
+        if brains and masks:
+            subjects.append((os.path.basename(os.path.normpath(subject_dir)), brains[0], masks[0]))
+    return subjects
+
+
+def init_worker(threads, use_cache):
+    # keep each process on its own cores instead of every process spawning a full thread pool
+    vtkMultiThreader.SetGlobalMaximumNumberOfThreads(threads)
+    vtkSMPTools.Initialize(threads)
+    vtkUtils.PIPELINE_WORKERS = threads  # label chains of a mask, also bounded by the worker's share
+    vtkUtils.mesh_cache.enabled = use_cache
+    vtkUtils.block_cache.enabled = use_cache
+    vtkUtils.volume_cache.enabled = use_cache  # every subject is read once, inflating it only evicts the viewer's
+    volume_index.enabled = False  # workers would rewrite the shared file over each other
+
+
+def export_subject(subject, brain_file, mask_file, output_dir, threshold, brain_smoothness, mask_smoothness,
+                   file_format='vtp', quantize=EXPORT_QUANTIZE):
+    report = {'subject': subject, 'brain': brain_file, 'mask': mask_file, 'status': 'ok', 'seconds': {}}
+    subject_dir = os.path.join(output_dir, subject)
+    start = time.perf_counter()
+    try:
+        for file in (brain_file, mask_file):
+            if not os.path.isfile(file):
+                raise FileNotFoundError(file)  # vtkNIFTIImageReader only logs and returns an empty image
+        problems = pairing_problems(brain_file, mask_file)
+        if problems:
+            report['status'] = 'rejected'
+            report['error'] = '; '.join(problems)
+            report['seconds']['total'] = time.perf_counter() - start
+            return report
+        os.makedirs(subject_dir, exist_ok=True)
+
+        stage_start = time.perf_counter()
+        brain = vtkUtils.load_brain(brain_file, threshold, brain_smoothness)
+        report['seconds']['brain'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        mask = vtkUtils.load_mask(mask_file, mask_smoothness)
+        report['seconds']['mask'] = time.perf_counter() - stage_start
+        if mask.problem:
+            report['status'] = 'rejected'
+            report['error'] = mask.problem
+        report['seconds']['labels'] = {label_idx + 1: label.seconds for label_idx, label in enumerate(mask.labels)
+                                       if label.extractor}
+
+        stage_start = time.perf_counter()
+        meshes = [('brain', brain.labels[0])]
+        meshes += [('label_{}'.format(label_idx + 1), label) for label_idx, label in enumerate(mask.labels)]
+        meshes = [(name, label.mapper.GetInput(), label.color, label.opacity) for name, label in meshes if label.mapper]
+        report['meshes'] = {name: poly_data.GetNumberOfCells() for name, poly_data, _, _ in meshes}
+        if file_format == 'vtp':
+            for name, poly_data, _, _ in meshes:
+                vtkUtils.write_mesh(poly_data, os.path.join(subject_dir, name + '.vtp'))
+        else:
+            export_meshes(meshes, subject_dir, file_format, quantize)
+        if mask.statistics is not None:
+            vtkUtils.write_label_statistics(mask, os.path.join(subject_dir, 'labels.csv'))
+        report['seconds']['write'] = time.perf_counter() - stage_start
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+    report['seconds']['total'] = time.perf_counter() - start
+
+    if os.path.isdir(subject_dir):
+        with open(os.path.join(subject_dir, 'timing.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Export brain and mask surface meshes without a display.')
+    parser.add_argument('input', help='directory of subjects or CSV manifest (subject,brain,mask)')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='VTK threads inside each worker')
+    parser.add_argument('--brain', default='T1.nii.gz', help='brain file name pattern in directory mode')
+    parser.add_argument('--mask', default='mask.nii.gz', help='mask file name pattern in directory mode')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='brain isovalue, defaults to the middle of the scalar range')
+    parser.add_argument('--brain-smoothness', type=int, default=BRAIN_SMOOTHNESS)
+    parser.add_argument('--mask-smoothness', type=int, default=MASK_SMOOTHNESS)
+    parser.add_argument('--format', default='vtp', choices=('vtp',) + EXPORT_FORMATS,
+                        help='mesh file format, glb writes all surfaces of a subject to one surfaces.glb')
+    parser.add_argument('--no-quantize', dest='quantize', action='store_false',
+                        help='keep float positions and normals in glb files')
+    parser.add_argument('--cache', action='store_true', help='also fill the viewer mesh and volume caches')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    subjects = find_subjects(args.input, args.brain, args.mask)
+    if not subjects:
+        print('No subjects found in ' + args.input)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    reports = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(args.threads_per_worker, args.cache)) as pool:
+        futures = [pool.submit(export_subject, subject, brain_file, mask_file, args.output, args.threshold,
+                               args.brain_smoothness, args.mask_smoothness, args.format, args.quantize)
+                   for subject, brain_file, mask_file in subjects]
+        for future in as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            print('[{}/{}] {} {} {:.1f}s'.format(len(reports), len(subjects), report['subject'], report['status'],
+                                                 report['seconds']['total']))
+
+    reports.sort(key=lambda report: report['subject'])
+    with open(os.path.join(args.output, 'report.json'), 'w') as f:
+        json.dump({'seconds': time.perf_counter() - start, 'subjects': reports}, f, indent=2)
+
+    failed = [report['subject'] for report in reports if report['status'] != 'ok']
+    if failed:
+        print('Failed : ' + ', '.join(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
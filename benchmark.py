@@ -0,0 +1,208 @@
+"""Benchmark every stage of the vtkUtils surface pipeline.
+
+Runs read, extraction, decimation, smoothing (Laplacian and windowed sinc)
+and normals on the volumes in nifti_data/ and on synthetic volumes of growing
+size, recording wall time, peak RSS and triangle counts per stage.
+
+    python3 benchmark.py --save-baseline          # store the reference numbers
+    python3 benchmark.py --compare                # fail if a stage got slower
+
+Every case runs in a fresh process so peak RSS belongs to that case alone.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from vtkmodules.vtkCommonCore import vtkVersion
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkAppendPolyData
+from vtkmodules.vtkIOImage import vtkNIFTIImageWriter
+from vtkmodules.vtkImagingCore import vtkImageShiftScale, vtkRTAnalyticSource
+
+import vtkUtils
+from config import *
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nifti_data')
+DATA_CASES = [('T1', 'brain'), ('T1CE', 'brain'), ('T2', 'brain'), ('FLAIR', 'brain'),
+              ('mask', 'mask'), ('GlistrBoost', 'mask')]
+SYNTHETIC_LABELS = 4
+BASELINE_FILE = 'benchmark_baseline.json'
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def write_synthetic_volume(size, kind, directory):
+    # analytic wavelet volume, quantised into label bands for the mask case
+    half = size // 2
+    source = vtkRTAnalyticSource()
+    source.SetWholeExtent(-half, size - half - 1, -half, size - half - 1, -half, size - half - 1)
+    source.Update()
+    output = source
+    if kind == 'mask':
+        low, high = source.GetOutput().GetScalarRange()
+        scale = vtkImageShiftScale()
+        scale.SetInputConnection(source.GetOutputPort())
+        scale.SetShift(-low)
+        scale.SetScale(SYNTHETIC_LABELS / (high - low))
+        scale.SetOutputScalarTypeToUnsignedChar()
+        scale.ClampOverflowOn()
+        output = scale
+
+    # uncompressed, so the volume cache passes it through instead of keeping a copy
+    file_name = os.path.join(directory, 'synthetic_{}_{}.nii'.format(kind, size))
+    writer = vtkNIFTIImageWriter()
+    writer.SetInputConnection(output.GetOutputPort())
+    writer.SetFileName(file_name)
+    writer.Write()
+    return file_name
+
+
+def run_case(file_name, kind, smoothness):
+    stages = {}
+
+    def measure(name, algorithm):
+        start = time.perf_counter()
+        algorithm.Update()
+        stages[name] = {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+        output = algorithm.GetOutputDataObject(0)
+        if isinstance(output, vtkPolyData):
+            stages[name]['cells'] = output.GetNumberOfCells()
+        return algorithm
+
+    nii_object = vtkUtils.NiiObject()
+    nii_object.file = file_name
+    start = time.perf_counter()
+    nii_object.reader = vtkUtils.read_volume(file_name)
+    stages['read'] = {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+    image = nii_object.reader.GetOutput()
+    scalar_range = image.GetScalarRange()
+
+    if kind == 'brain':
+        extractor = vtkUtils.create_brain_extractor(nii_object)
+        extractor.SetValue(0, sum(scalar_range) / 2)
+    else:
+        # every label cropped to its own box, appended so the later stages see all of them,
+        # the label extractors are kept referenced, a connection alone does not keep them alive
+        label_extractors = [vtkUtils.create_mask_extractor(nii_object, value, extent) for value, extent in
+                            vtkUtils.label_extents(image, max(int(scalar_range[1]), 1), MASK_ROI_PADDING).items()]
+        extractor = vtkAppendPolyData()
+        for label_extractor in label_extractors:
+            extractor.AddInputConnection(label_extractor.GetOutputPort())
+    measure('extract', extractor)
+    reducer = measure('decimate', vtkUtils.create_polygon_reducer(extractor))
+    smoother = measure('smooth', vtkUtils.create_smoother(reducer, smoothness))
+    measure('smooth_sinc', vtkUtils.create_sinc_smoother(reducer, smoothness))
+    measure('normals', vtkUtils.create_normals(smoother))
+
+    return {'kind': kind, 'dimensions': list(image.GetDimensions()), 'stages': stages}
+
+
+def run_isolated(pool_context, file_name, kind, smoothness, repeat):
+    # best of repeat runs, each in a fresh process
+    best = None
+    for _ in range(repeat):
+        with pool_context.Pool(1) as pool:
+            result = pool.apply(run_case, (file_name, kind, smoothness))
+        if best is None:
+            best = result
+        else:
+            for name, stage in result['stages'].items():
+                if stage['seconds'] < best['stages'][name]['seconds']:
+                    best['stages'][name] = stage
+    return best
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    regressions = []
+    print('{:<28} {:<14} {:>10} {:>10} {:>8}'.format('case', 'stage', 'baseline', 'current', 'ratio'))
+    for case, result in results['cases'].items():
+        base_case = baseline['cases'].get(case)
+        if not base_case:
+            continue
+        for name, stage in result['stages'].items():
+            base_stage = base_case['stages'].get(name)
+            if not base_stage:
+                continue
+            ratio = stage['seconds'] / base_stage['seconds'] if base_stage['seconds'] else float('inf')
+            slower = stage['seconds'] - base_stage['seconds']
+            flag = ''
+            if ratio > 1 + tolerance and slower > min_seconds:
+                flag = '  REGRESSION'
+                regressions.append((case, name))
+            print('{:<28} {:<14} {:>10.3f} {:>10.3f} {:>8.2f}{}'.format(case, name, base_stage['seconds'],
+                                                                       stage['seconds'], ratio, flag))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the vtkUtils pipeline stages.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='results file')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[128, 256, 512],
+                        help='edge lengths of the synthetic volumes')
+    parser.add_argument('--cases', nargs='*', default=None, help='only run cases with these names')
+    parser.add_argument('--smoothness', type=int, default=BRAIN_SMOOTHNESS)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case, the fastest is kept')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='ignore slowdowns below this')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pool_context = multiprocessing.get_context('spawn')
+    results = {
+        'meta': {'python': platform.python_version(), 'vtk': vtkVersion.GetVTKVersion(),
+                 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'smoothness': args.smoothness},
+        'cases': {},
+    }
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        cases = [(name, kind, os.path.join(DATA_DIR, name + '.nii.gz')) for name, kind in DATA_CASES]
+        for size in args.sizes:
+            for kind in ('brain', 'mask'):
+                cases.append(('synthetic_{}_{}'.format(kind, size), kind, None))
+
+        for name, kind, file_name in cases:
+            if args.cases and name not in args.cases:
+                continue
+            if file_name is None:
+                file_name = write_synthetic_volume(int(name.rsplit('_', 1)[1]), kind, synthetic_dir)
+            result = run_isolated(pool_context, file_name, kind, args.smoothness, args.repeat)
+            results['cases'][name] = result
+            print('{:<28} {}'.format(name, '  '.join('{} {:.3f}s'.format(stage, values['seconds'])
+                                                     for stage, values in result['stages'].items())))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print('No baseline at ' + args.baseline + ', run with --save-baseline first')
+            return 1
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('smoothness') != args.smoothness:
+            print('Warning : baseline was recorded with smoothness {}'.format(baseline['meta'].get('smoothness')))
+        if compare(results, baseline, args.tolerance, args.min_seconds):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import os
+
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkAppendPolyData, vtkFlyingEdges3D
+from vtkmodules.vtkImagingCore import vtkExtractVOI
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+from diskCache import DiskCache, file_hash
+
+try:
+    import numpy
+    from vtkmodules.util import numpy_support
+except ImportError:  # numpy is optional, the brain surface is then contoured over the whole volume
+    numpy = None
+
+
+def can_index_blocks():
+    return numpy is not None
+
+
+def block_reduce(values, reduce, block, axis):
+    # reduce over blocks of cells along axis, a block's cells reach one voxel into the next block
+    starts = numpy.arange(0, values.shape[axis] - 1, block)
+    reduced = reduce.reduceat(values, starts, axis=axis)
+    ends = numpy.take(values, numpy.minimum(starts + block, values.shape[axis] - 1), axis=axis)
+    return reduce(reduced, ends)
+
+
+class BlockIndex:
+    """Scalar min/max of every block of block^3 cells, the span space of a volume.
+
+    Blocks are sorted by their minimum, so the blocks an isovalue passes
+    through are a binary search plus a check of the maxima, the voxels are
+    never looked at again. Built once per volume and kept on disk beside the
+    inflated copy.
+    """
+
+    def __init__(self, extent, block, lows, highs):
+        self.extent = tuple(extent)
+        self.block = block
+        self.lows = lows  # (z, y, x) blocks
+        self.highs = highs
+        self.order = numpy.argsort(lows, axis=None, kind='stable')
+        self.sorted_lows = lows.ravel()[self.order]
+
+    @classmethod
+    def build(cls, image, block):
+        dims = image.GetDimensions()
+        voxels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dims[::-1])
+        lows, highs = voxels, voxels
+        for axis in range(3):
+            lows = block_reduce(lows, numpy.minimum, block, axis)
+            highs = block_reduce(highs, numpy.maximum, block, axis)
+        return cls(image.GetExtent(), block, lows, highs)
+
+    def active_blocks(self, isovalue):
+        # (z, y, x) block indices whose range holds isovalue
+        candidates = self.order[:numpy.searchsorted(self.sorted_lows, isovalue, side='right')]
+        active = candidates[self.highs.ravel()[candidates] >= isovalue]
+        return numpy.unravel_index(numpy.sort(active), self.lows.shape)
+
+    def active_boxes(self, isovalue):
+        # voxel extents of the runs of neighbouring active blocks along x, neighbours share a voxel plane
+        z, y, x = self.active_blocks(isovalue)
+        if not len(x):
+            return []
+        breaks = numpy.flatnonzero((numpy.diff(x) != 1) | (numpy.diff(y) != 0) | (numpy.diff(z) != 0)) + 1
+        x0, x1, y0, y1, z0, z1 = self.extent
+        boxes = []
+        for run in numpy.split(numpy.arange(len(x)), breaks):
+            first, last = run[0], run[-1]
+            boxes.append((x0 + x[first] * self.block, min(x0 + (x[last] + 1) * self.block, x1),
+                          y0 + y[first] * self.block, min(y0 + (y[first] + 1) * self.block, y1),
+                          z0 + z[first] * self.block, min(z0 + (z[first] + 1) * self.block, z1)))
+        return boxes
+
+    def active_fraction(self, isovalue):
+        return len(self.active_blocks(isovalue)[0]) / self.lows.size
+
+
+def seam_voxels(image, boxes, block, isovalue, tolerance):
+    """True when a voxel on a plane shared by two runs (nearly) equals the isovalue.
+
+    A point made there sits on the voxel itself, several edges put a point
+    at the same place and nothing tells which of them a copy came from.
+    """
+    voxels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(image.GetDimensions()[::-1])
+    x0, x1, y0, y1, z0, z1 = image.GetExtent()
+    for bx0, bx1, by0, by1, bz0, bz1 in boxes:
+        xs, ys, zs = slice(bx0 - x0, bx1 - x0 + 1), slice(by0 - y0, by1 - y0 + 1), slice(bz0 - z0, bz1 - z0 + 1)
+        planes = [voxels[zs, y - y0, xs] for y in (by0, by1) if y0 < y < y1]
+        planes += [voxels[z - z0, ys, xs] for z in (bz0, bz1) if z0 < z < z1]
+        if any((numpy.abs(plane - isovalue) <= tolerance).any() for plane in planes):
+            return True
+    return False
+
+
+def weld_seams(poly_data, image, block):
+    """Merges the points made twice on the y and z planes between neighbouring runs of blocks.
+
+    Runs never touch along x, so only points on those planes are compared.
+    Copies are matched by the voxel edge they were interpolated on, which
+    needs every point to lie inside an edge, see seam_voxels().
+    """
+    points = numpy_support.vtk_to_numpy(poly_data.GetPoints().GetData())
+    origin, spacing, extent = image.GetOrigin(), image.GetSpacing(), image.GetExtent()
+    index = (points - origin) / spacing
+    offsets = numpy.abs(index - numpy.rint(index))
+    on_seam = ((offsets[:, 1:] < 1e-3) & ((numpy.rint(index[:, 1:]) - extent[2:6:2]) % block == 0)).any(axis=1)
+    seam_ids = numpy.flatnonzero(on_seam)
+    if not seam_ids.size:
+        return poly_data
+
+    # the edge runs along the one coordinate that is not a voxel index, from the voxel below the point
+    seam = index[seam_ids]
+    axis = numpy.argmax(offsets[seam_ids], axis=1)
+    lower = numpy.rint(seam).astype(numpy.int64)
+    rows = numpy.arange(len(seam))
+    lower[rows, axis] = numpy.floor(seam[rows, axis])
+    lower -= extent[0::2]
+    nx, ny = image.GetDimensions()[:2]
+    keys = ((lower[:, 2] * ny + lower[:, 1]) * nx + lower[:, 0]) * 3 + axis
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+
+    remap = numpy.arange(len(points))
+    remap[seam_ids] = seam_ids[first][inverse.ravel()]
+    keep = remap == numpy.arange(len(points))
+    remap = (numpy.cumsum(keep) - 1)[remap]
+
+    welded = vtkPolyData()
+    welded_points = vtkPoints()
+    welded_points.SetData(numpy_support.numpy_to_vtk(points[keep], deep=True))
+    welded.SetPoints(welded_points)
+    point_data = poly_data.GetPointData()
+    for array_idx in range(point_data.GetNumberOfArrays()):
+        values = numpy_support.vtk_to_numpy(point_data.GetArray(array_idx))
+        array = numpy_support.numpy_to_vtk(values[keep], deep=True)
+        array.SetName(point_data.GetArrayName(array_idx))
+        welded.GetPointData().AddArray(array)
+    welded.GetPointData().SetActiveScalars(point_data.GetScalars() and point_data.GetScalars().GetName())
+    welded.GetPointData().SetActiveNormals(point_data.GetNormals() and point_data.GetNormals().GetName())
+
+    polys = poly_data.GetPolys()
+    connectivity = remap[numpy_support.vtk_to_numpy(polys.GetConnectivityArray())]
+    cells = vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(numpy_support.vtk_to_numpy(polys.GetOffsetsArray()), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=True))
+    welded.SetPolys(cells)
+    return welded
+
+
+class BlockIndexCache(DiskCache):
+    """Block indexes of the volumes opened before, keyed by the content hash of the file."""
+
+    def __init__(self, directory, max_bytes):
+        DiskCache.__init__(self, directory, max_bytes, '.npz')
+
+    def get(self, file, extent, block):
+        if not self.enabled:
+            return None
+        path = self.path('{}-{}'.format(file_hash(file), block))
+        try:
+            with numpy.load(path) as data:
+                if tuple(data['extent']) != tuple(extent):
+                    raise ValueError(path)
+                index = BlockIndex(extent, block, data['lows'], data['highs'])
+        except (OSError, ValueError, KeyError):
+            self.count(False)
+            return None
+        self.touch(path)
+        self.count(True)
+        return index
+
+    def put(self, file, index):
+        if not self.enabled:
+            return
+        key = '{}-{}'.format(file_hash(file), index.block)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.tmp_path(key) + self.suffix  # numpy.savez only writes .npz names
+            numpy.savez(tmp_path, extent=index.extent, lows=index.lows, highs=index.highs)
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            return
+        self.evict()
+
+
+class BlockSurface(VTKPythonAlgorithmBase):
+    """vtkFlyingEdges3D over the active blocks of a BlockIndex only.
+
+    Each run of active blocks is contoured on its own, the pieces are appended
+    and the points on the shared planes welded by the voxel edge they lie on,
+    so the surface has the triangles of the whole volume's while blocks the
+    isovalue misses are skipped. When a voxel on a shared plane equals the
+    isovalue the box around all runs is contoured as one piece instead. Above
+    max_active of the blocks the whole volume is contoured at once, welding
+    that many pieces costs more than the skipped voxels. Every execution makes
+    its own filters and may run on any thread.
+    """
+
+    def __init__(self, index, max_active=0.1):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=1, inputType='vtkImageData',
+                                        nOutputPorts=1, outputType='vtkPolyData')
+        self.index = index
+        self.max_active = max_active
+        self.value = 0.0
+        self.active_fraction = 1.0  # of the last execution
+        # voxels on a seam this close to the isovalue put points too near a voxel to tell their edge apart
+        self.tolerance = 1e-5 * (float(index.highs.max()) - float(index.lows.min()))
+
+    def clone(self):
+        return BlockSurface(self.index, self.max_active)
+
+    def SetValue(self, index, value):
+        if value != self.value:
+            self.value = value
+            self.Modified()
+
+    def GetValue(self, index):
+        return self.value
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def contour_whole(self, image, output, box=None):
+        contour = vtkFlyingEdges3D()
+        if box is None:  # no copy of the volume, contoured exactly as without an index
+            contour.SetInputData(image)
+        else:
+            cropper = vtkExtractVOI()
+            cropper.SetInputData(image)
+            cropper.SetVOI(box)
+            contour.SetInputConnection(cropper.GetOutputPort())
+        contour.SetValue(0, self.value)
+        contour.Update()
+        output.ShallowCopy(contour.GetOutput())
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        image = self.GetInputData(inInfo, 0, 0)
+        output = vtkPolyData.GetData(outInfo)
+        self.active_fraction = self.index.active_fraction(self.value)
+        if self.active_fraction > self.max_active:
+            return self.contour_whole(image, output)
+        boxes = self.index.active_boxes(self.value)
+        if not boxes:
+            return 1
+        if seam_voxels(image, boxes, self.index.block, self.value, self.tolerance):
+            # one piece over the box around all runs, no seams to weld
+            box = [min(box[i] for box in boxes) if i % 2 == 0 else max(box[i] for box in boxes) for i in range(6)]
+            return self.contour_whole(image, output, box)
+
+        cropper = vtkExtractVOI()
+        cropper.SetInputData(image)
+        contour = vtkFlyingEdges3D()
+        contour.SetInputConnection(cropper.GetOutputPort())
+        contour.SetValue(0, self.value)
+        append = vtkAppendPolyData()
+        for index, box in enumerate(boxes):
+            if self.GetAbortExecute():
+                return 1
+            cropper.SetVOI(box)
+            contour.Update()
+            piece = vtkPolyData()
+            piece.ShallowCopy(contour.GetOutput())
+            append.AddInputData(piece)
+            self.UpdateProgress(index / len(boxes))
+
+        append.Update()
+        output.ShallowCopy(weld_seams(append.GetOutput(), image, self.index.block))
+        return 1
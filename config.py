@@ -1,3 +1,5 @@
+import os
+
 # default brain settings
 APPLICATION_TITLE = "3D Brain Imaging - A NifTI Visualizer"
 BRAIN_SMOOTHNESS = 500
@@ -17,3 +19,81 @@ MASK_COLORS = [(1, 0, 0),
                 (0.5, 0.5, 1),
                 (0.5,0,1)]  # RGB percentages
 MASK_OPACITY = 1.0
+
+# surface pipeline settings
+MESH_REDUCTION = 0.5  # least target reduction of vtkDecimatePro
+MAX_MESH_REDUCTION = 0.98
+BRAIN_TRIANGLE_BUDGET = 600000  # triangles the brain surface may keep
+MASK_TRIANGLE_BUDGET = 400000  # shared by all mask labels, small labels are never reduced further
+MESH_FEATURE_ANGLE = 60.0
+MASK_ROI_PADDING = 1  # voxels kept around each label's bounding box so its surface stays closed
+SMOOTHER = 'laplacian'  # or 'sinc', windowed sinc converges in a few dozen iterations
+SINC_ITERATIONS = 20
+SMOOTHING_CHECKPOINTS = 4  # smoothed meshes kept per label to continue from
+
+# background surface pipeline settings
+PIPELINE_WORKERS = os.cpu_count() or 1  # surface chains run side by side, one per label
+PIPELINE_DEBOUNCE_MS = 250  # wait for the spinbox to settle before re-extracting
+
+# progressive brain threshold preview
+PROGRESSIVE_PREVIEW = True
+PREVIEW_MAX_VOXELS = 128 ** 3  # size of the coarse copy the preview surface is extracted from
+PREVIEW_SMOOTHNESS = 20
+
+# on-disk cache of finished meshes
+MESH_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', '3d-brain-imaging', 'meshes')
+MESH_CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+# inflated copies of .nii.gz inputs, read through a memory map when possible
+VOLUME_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', '3d-brain-imaging', 'volumes')
+VOLUME_CACHE_MAX_BYTES = 4 * 1024 ** 3
+MEMORY_MAP_VOLUMES = True
+
+# min/max of every block of the brain volume, threshold changes only contour the blocks the isovalue crosses
+BLOCK_INDEX_SIZE = 16  # cells per block edge
+BLOCK_INDEX_MAX_ACTIVE = 0.1  # above this fraction of active blocks the whole volume is contoured at once
+BLOCK_INDEX_MAX_BYTES = 64 * 1024 ** 2  # kept in VOLUME_CACHE_DIR next to the inflated volumes
+
+# volumes larger than this are never read whole, they are read and contoured in slabs
+STREAMING_MIN_BYTES = 2 * 1024 ** 3
+STREAMING_SLAB_BYTES = 128 * 1024 ** 2
+
+# scalar range and label values of volumes already read, checked before a new pairing loads
+VOLUME_INDEX_FILE = os.path.join(os.path.expanduser('~'), '.cache', '3d-brain-imaging', 'volume_index.json')
+MASK_MAX_LABELS = 1000  # distinct values, a mask with more is most likely an image picked by mistake
+
+# recently opened brains and masks stay loaded so switching back is instant
+SESSION_MAX_BYTES = 2 * 1024 ** 3
+
+# startup_check.py fails when importing main takes longer (seconds, warm disk cache)
+STARTUP_IMPORT_BUDGET = 0.5
+
+# pipeline instrumentation
+PROFILING = True
+PROFILE_LOG_FILE = None  # path of a JSON lines log of every stage execution
+
+# level of detail, coarser meshes are drawn while the camera moves
+LOD_DIVISIONS = (64, 24)  # vtkQuadricClustering divisions per axis of each coarser level
+LOD_MIN_CELLS = 50000  # smaller surfaces are always drawn at full detail
+INTERACTIVE_FPS = 30
+RENDER_MAX_FPS = 60  # renders requested by the controls are coalesced down to this rate
+
+# 2D slice panes
+SLICE_CACHE_SLICES = 128  # colored slices kept for the three panes together
+SLICE_PREFETCH = 8  # slices colored ahead in the scroll direction, half as many behind
+
+# mesh export
+EXPORT_FORMAT = 'glb'  # glb, ply or stl
+EXPORT_QUANTIZE = True  # 16-bit positions and 8-bit normals in glb files
+
+# offscreen snapshot service (renderService.py)
+RENDER_SERVICE_PORT = 8600
+RENDER_SERVICE_WORKERS = 4  # render processes, each keeps its own recently used volumes loaded
+SNAPSHOT_SIZE = 512  # pixels, snapshots are square
+SNAPSHOT_MAX_SIZE = 2048
+SNAPSHOT_BACKGROUND = (0.0, 0.0, 0.0)
+
+# direct volume rendering of the brain, ray cast on the CPU
+VOLUME_RENDER_THREADS = os.cpu_count() or 1
+VOLUME_OPACITY_RAMP = 0.05  # fraction of the scalar range over which opacity rises past the threshold
+VOLUME_SHADE = True
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+
+_file_hashes = {}  # (path, size, mtime) -> content hash
+_file_hashes_lock = threading.Lock()
+
+
+def file_hash(file):
+    stat = os.stat(file)
+    stamp = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if stamp in _file_hashes:
+            return _file_hashes[stamp]
+
+    digest = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    with _file_hashes_lock:
+        _file_hashes[stamp] = digest.hexdigest()
+    return _file_hashes[stamp]
+
+
+class DiskCache:
+    """Size-bounded directory of cache files, least recently used are evicted first."""
+
+    def __init__(self, directory, max_bytes, suffix):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def tmp_path(self, key):
+        # unique per writer so concurrent writers never expose a partial file
+        return os.path.join(self.directory, '{}.{}.tmp'.format(key, os.urandom(8).hex()))
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def touch(self, path):
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
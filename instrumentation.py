@@ -0,0 +1,140 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+from vtkmodules.vtkCommonCore import vtkCommand
+from vtkmodules.vtkCommonDataModel import vtkDataSet
+
+from config import *
+
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # no procfs, fall back to the peak which still shows growth
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageRecord:
+    def __init__(self, run, stage, label, class_name):
+        self.run = run
+        self.stage = stage
+        self.label = label
+        self.class_name = class_name
+        self.start = time.perf_counter()
+        self.start_rss = current_rss_bytes()
+        self.seconds = None
+        self.progress = 0.0
+        self.cells = None
+        self.points = None
+        self.output_kb = None
+        self.memory_delta_mb = None
+        self.thread = threading.current_thread().name
+
+    def finish(self, data):
+        self.seconds = time.perf_counter() - self.start
+        self.memory_delta_mb = (current_rss_bytes() - self.start_rss) / 1024 ** 2
+        self.progress = 1.0
+        if isinstance(data, vtkDataSet):
+            self.points = data.GetNumberOfPoints()
+            self.cells = data.GetNumberOfCells()
+            self.output_kb = data.GetActualMemorySize()
+
+    def as_dict(self):
+        return {'run': self.run, 'stage': self.stage, 'label': self.label, 'class': self.class_name, 'seconds': self.seconds,
+                'cells': self.cells, 'points': self.points, 'output_kb': self.output_kb,
+                'memory_delta_mb': self.memory_delta_mb, 'thread': self.thread}
+
+
+class PipelineProfiler:
+    """Collects per-stage timings from VTK Start/End/Progress events.
+
+    watch() is called by the vtkUtils factories, so every filter that executes
+    (on the GUI thread or a pipeline worker) leaves a StageRecord behind.
+    """
+
+    def __init__(self, enabled=True, log_file=None):
+        self.enabled = enabled
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        # keyed by object address so the profiler never keeps a pipeline (and its data) alive
+        self.tags = {}  # address -> {'stage', 'run', 'label'}
+        self.active = {}  # address -> StageRecord still executing
+        self.latest = {}  # (run, stage, label) -> last finished StageRecord
+        self.last_run = None
+        self.version = 0  # bumped on every change so views know when to refresh
+
+    def watch(self, algorithm, stage, run=None):
+        if not self.enabled:
+            return algorithm
+        address = algorithm.GetAddressAsString('vtkObject')
+        self.tags[address] = {'stage': stage, 'run': run, 'label': None}
+        algorithm.AddObserver(vtkCommand.StartEvent, lambda caller, event: self.on_start(caller, address))
+        algorithm.AddObserver(vtkCommand.EndEvent, lambda caller, event: self.on_end(caller, address))
+        algorithm.AddObserver(vtkCommand.ProgressEvent, lambda caller, event: self.on_progress(caller, address))
+        algorithm.AddObserver(vtkCommand.DeleteEvent, lambda caller, event: self.tags.pop(address, None))
+        return algorithm
+
+    def set_run(self, run, *algorithms, label=None):
+        for algorithm in algorithms:
+            tag = self.tags.get(algorithm.GetAddressAsString('vtkObject'))
+            if tag is not None:
+                tag['run'] = run
+                tag['label'] = label
+
+    def on_start(self, caller, address):
+        tag = self.tags.get(address, {'stage': None, 'run': None, 'label': None})
+        record = StageRecord(tag['run'], tag['stage'], tag['label'], caller.GetClassName())
+        with self.lock:
+            self.active[address] = record
+            self.version += 1
+
+    def on_progress(self, caller, address):
+        record = self.active.get(address)
+        if record is not None and hasattr(caller, 'GetProgress'):
+            record.progress = caller.GetProgress()
+
+    def on_end(self, caller, address):
+        with self.lock:
+            record = self.active.pop(address, None)
+        if record is None:
+            return
+        data = caller.GetOutputDataObject(0) if hasattr(caller, 'GetOutputDataObject') else None
+        record.finish(data)
+        with self.lock:
+            self.latest[(record.run, record.stage, record.label)] = record
+            if record.stage != 'render':
+                self.last_run = record.run
+            self.version += 1
+        self.write_log(record.as_dict())
+
+    def note(self, run, **values):
+        # values worth keeping that are not tied to a filter execution
+        self.write_log(dict(values, run=run, stage='note'))
+
+    def write_log(self, entry):
+        if not self.log_file:
+            return
+        entry['time'] = time.time()
+        with self.lock:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def breakdown(self):
+        # finished stages of the most recent run plus the last render, then anything still executing
+        with self.lock:
+            records = [record for record in self.latest.values()
+                       if record.run == self.last_run and record.stage != 'render']
+            records.sort(key=lambda record: record.start)
+            render = [record for record in self.latest.values() if record.stage == 'render']
+            active = sorted(self.active.values(), key=lambda record: record.start)
+        return records + render[-1:], active
+
+
+profiler = PipelineProfiler(PROFILING, PROFILE_LOG_FILE)  # shared by the viewer and the pipeline
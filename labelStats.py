@@ -0,0 +1,128 @@
+from vtkmodules.vtkImagingStatistics import vtkImageAccumulate
+
+try:
+    import numpy
+    from vtkmodules.util import numpy_support
+except ImportError:  # numpy is optional, labels then keep the whole extent and get no statistics
+    numpy = None
+
+STATISTICS_COLUMNS = ['label', 'voxels', 'volume_mm3', 'surface_mm2', 'centroid_x', 'centroid_y', 'centroid_z',
+                      'voxel_x_min', 'voxel_x_max', 'voxel_y_min', 'voxel_y_max', 'voxel_z_min', 'voxel_z_max']
+
+
+def can_compute_statistics():
+    return numpy is not None
+
+
+class LabelStatistics:
+    """Voxel count, bounding box and centroid of every label value 1..n_labels.
+
+    add() takes the whole label volume or its slabs one after another, each is
+    swept once and only the labelled voxels are looked at afterwards.
+    """
+
+    def __init__(self, n_labels):
+        self.n_labels = n_labels
+        self.counts = numpy.zeros(n_labels + 1, numpy.int64)
+        self.sums = numpy.zeros((3, n_labels + 1))
+        self.lows = numpy.full((3, n_labels + 1), numpy.iinfo(numpy.int64).max)
+        self.highs = numpy.full((3, n_labels + 1), numpy.iinfo(numpy.int64).min)
+        self.spacing = (1.0, 1.0, 1.0)
+        self.origin = (0.0, 0.0, 0.0)
+
+    def add(self, image):
+        self.spacing = image.GetSpacing()
+        self.origin = image.GetOrigin()
+        voxels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        indices = numpy.flatnonzero((voxels >= 1) & (voxels <= self.n_labels))
+        values = voxels[indices].astype(numpy.intp)
+        extent = image.GetExtent()
+        coordinates = numpy.unravel_index(indices, image.GetDimensions()[::-1])[::-1]  # x, y, z
+
+        self.counts += numpy.bincount(values, minlength=self.n_labels + 1)
+        for axis, coordinate in enumerate(coordinates):
+            coordinate = coordinate + extent[2 * axis]
+            self.sums[axis] += numpy.bincount(values, coordinate, self.n_labels + 1)
+            numpy.minimum.at(self.lows[axis], values, coordinate)
+            numpy.maximum.at(self.highs[axis], values, coordinate)
+        return self
+
+    def extents(self, whole, pad=0):
+        # padded voxel extent of every label with voxels, clipped to the whole extent
+        extents = {}
+        for value in range(1, self.n_labels + 1):
+            if not self.counts[value]:
+                continue
+            extent = []
+            for axis in range(3):
+                extent.append(max(int(self.lows[axis, value]) - pad, whole[2 * axis]))
+                extent.append(min(int(self.highs[axis, value]) + pad, whole[2 * axis + 1]))
+            extents[value] = extent
+        return extents
+
+    def row(self, value):
+        # dict of one label, None without voxels, lengths in the units of the NIfTI spacing (mm)
+        count = int(self.counts[value])
+        if not count:
+            return None
+        voxel_volume = self.spacing[0] * self.spacing[1] * self.spacing[2]
+        centroid = [self.origin[axis] + self.spacing[axis] * self.sums[axis, value] / count for axis in range(3)]
+        row = {'label': value, 'voxels': count, 'volume_mm3': count * voxel_volume,
+               'centroid_x': centroid[0], 'centroid_y': centroid[1], 'centroid_z': centroid[2]}
+        for axis, name in enumerate('xyz'):
+            row['voxel_{}_min'.format(name)] = int(self.lows[axis, value])
+            row['voxel_{}_max'.format(name)] = int(self.highs[axis, value])
+        return row
+
+    def rows(self):
+        # one dict per label with voxels
+        return [row for row in map(self.row, range(1, self.n_labels + 1)) if row is not None]
+
+
+def label_values(image, limit):
+    """Distinct non-zero values of a label volume, at most limit + 1 of them.
+
+    Atlases number their labels into the thousands (FreeSurfer), what tells an
+    image picked by mistake apart is how many different values it holds.
+    """
+    if numpy is None:
+        n_bins = int(image.GetScalarRange()[1])
+        if n_bins < 1:
+            return set()
+        accumulate = vtkImageAccumulate()
+        accumulate.SetInputData(image)
+        accumulate.SetComponentExtent(0, n_bins, 0, 0, 0, 0)
+        accumulate.SetComponentOrigin(0, 0, 0)
+        accumulate.SetComponentSpacing(1, 1, 1)
+        accumulate.Update()
+        counts = accumulate.GetOutput().GetPointData().GetScalars()
+        values = [value for value in range(1, n_bins + 1) if counts.GetTuple1(value)]
+        return set(values[:limit + 1])
+
+    voxels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    if voxels.dtype.kind in 'iu' and voxels.size and 0 <= voxels.min() and voxels.max() < 2 ** 24:
+        values = numpy.flatnonzero(numpy.bincount(voxels.astype(numpy.intp)))
+    else:
+        values = numpy.unique(voxels)  # floats and negative values, sorted
+    values = values[values != 0]
+    return set(values[:limit + 1].tolist())
+
+
+def label_extents(image, n_labels, pad=0):
+    """Voxel extent of every label value 1..n_labels, padded and clipped to the image.
+
+    Labels without a single voxel are left out. Without numpy only the empty
+    labels are found and every other label gets the whole extent.
+    """
+    whole = image.GetExtent()
+    if numpy is not None:
+        return LabelStatistics(n_labels).add(image).extents(whole, pad)
+
+    accumulate = vtkImageAccumulate()
+    accumulate.SetInputData(image)
+    accumulate.SetComponentExtent(0, n_labels, 0, 0, 0, 0)
+    accumulate.SetComponentOrigin(0, 0, 0)
+    accumulate.SetComponentSpacing(1, 1, 1)
+    accumulate.Update()
+    counts = accumulate.GetOutput().GetPointData().GetScalars()
+    return {value: list(whole) for value in range(1, n_labels + 1) if counts.GetTuple1(value)}
@@ -1,15 +1,35 @@
 import sys
-import math
-import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import PyQt5.QtWidgets as QtWidgets
 from PyQt5 import Qt
 
 
-from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
-from vtkUtils import *
+# only what the empty window needs, the pipeline and file modules load with the first volumes
+import vtkmodules.vtkInteractionStyle
+import vtkmodules.vtkRenderingOpenGL2
+from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+from vtkmodules.vtkRenderingCore import vtkRenderer
 from config import *
+from instrumentation import profiler
+from lazyImport import lazy_import
+from pipelineExecutor import PipelineExecutor
+from renderScheduler import RenderScheduler
+from slicePanes import SlicePanes
+from niftiHeader import read_header
+from volumeIndex import pairing_problems
+
+vtkUtils = lazy_import('vtkUtils')
+meshExport = lazy_import('meshExport')
+
+
+class SurfaceSignals(Qt.QObject):
+    # carries (label, polydata) from the pipeline workers back to the GUI thread
+    ready = Qt.pyqtSignal(object, object)
+    exported = Qt.pyqtSignal(object)  # written files or the error of a background export
+    preview_image = Qt.pyqtSignal(object, object)  # (brain, coarse copy or False) once it is shrunk
 
 
 class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
@@ -20,6 +40,19 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         
         # base setup
         self.renderer, self.frame, self.vtk_widget, self.interactor, self.render_window = self.setup()
+        self.render_scheduler = RenderScheduler(self.render_window, RENDER_MAX_FPS)
+
+        # background surface re-extraction
+        self.pipeline_executor = PipelineExecutor(PIPELINE_WORKERS)
+        self.surface_signals = SurfaceSignals()
+        self.surface_signals.ready.connect(self.surface_ready)
+        self.surface_signals.exported.connect(self.meshes_exported)
+        self.surface_signals.preview_image.connect(self.preview_image_ready)
+        self.export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+        self.preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+        self.preview_builds = set()  # brains whose preview copy is being shrunk
+        self.brain_surface_timer = self.create_debounce_timer(self.update_brain_surface)
+        self.mask_surface_timer = self.create_debounce_timer(self.update_mask_surfaces)
 
         # create grid for all widgets
         self.grid = QtWidgets.QGridLayout()
@@ -27,6 +60,7 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         # add each widget
         self.add_vtk_window_widget()
         self.add_brain_input_widget()
+        self.add_timing_widget()
 
         self.run() 
         
@@ -34,7 +68,7 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
     @staticmethod
     def setup():
         
-        renderer = vtk.vtkRenderer()
+        renderer = vtkRenderer()
         renderer.GlobalWarningDisplayOff()
         frame = QtWidgets.QFrame()
         vtk_widget = QVTKRenderWindowInteractor()
@@ -45,7 +79,9 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         vtk_widget.GetRenderWindow().AddRenderer(renderer)
         render_window.AddRenderer(renderer)
         interactor.SetRenderWindow(render_window)
-        interactor.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        interactor.SetInteractorStyle(vtkInteractorStyleTrackballCamera())
+        interactor.SetDesiredUpdateRate(INTERACTIVE_FPS)  # frame rate the LOD actors aim for while moving
+        profiler.watch(render_window, 'render', 'view')
 
 
         return renderer, frame, vtk_widget, interactor, render_window
@@ -66,6 +102,8 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         file_widget = QtWidgets.QWidget()
         file_widget.setLayout(hbox)
         groupBox_layout.addWidget(file_widget)
+        self.brain_header_label = QtWidgets.QLabel()
+        groupBox_layout.addWidget(self.brain_header_label)
 
         label = QtWidgets.QLabel("Mask File:")
         groupBox_layout.addWidget(label)
@@ -79,6 +117,8 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         file_widget = QtWidgets.QWidget()
         file_widget.setLayout(hbox)
         groupBox_layout.addWidget(file_widget)
+        self.mask_header_label = QtWidgets.QLabel()
+        groupBox_layout.addWidget(self.mask_header_label)
 
         self.qt_open_button = QtWidgets.QPushButton('Open')
         self.qt_open_button.clicked.connect(self.load_inputs)
@@ -88,13 +128,55 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         groupBox.setLayout(groupBox_layout)
         self.grid.addWidget(groupBox, 0, 0, 1, 2)
     
+    def add_timing_widget(self):
+        timing_group_box = QtWidgets.QGroupBox("Pipeline Timing")
+        self.timing_group_box = timing_group_box
+        timing_layout = QtWidgets.QVBoxLayout()
+        self.timing_table = QtWidgets.QTableWidget(0, 5)
+        self.timing_table.setHorizontalHeaderLabels(["Stage", "Label", "Time (ms)", "Cells", "Memory (MB)"])
+        self.timing_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.timing_table.verticalHeader().hide()
+        self.timing_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        timing_layout.addWidget(self.timing_table)
+        timing_group_box.setLayout(timing_layout)
+        self.grid.addWidget(timing_group_box, 5, 2, 2, 5)
+
+        # poll instead of pushing from the observers, they also fire on pipeline worker threads
+        self.timing_version = None
+        self.timing_timer = Qt.QTimer()
+        self.timing_timer.setInterval(500)
+        self.timing_timer.timeout.connect(self.refresh_timing_table)
+        self.timing_timer.start()
+
+    def refresh_timing_table(self):
+        frames = self.render_scheduler.stats()
+        self.timing_group_box.setTitle(
+            'Pipeline Timing  (frames rendered {rendered}, coalesced {coalesced})'.format(**frames))
+        if profiler.version == self.timing_version:
+            return
+        self.timing_version = profiler.version
+        records, active = profiler.breakdown()
+
+        rows = []
+        for record in records:
+            rows.append([record.stage, record.label, '{:.1f}'.format(record.seconds * 1000), record.cells,
+                         '{:+.1f}'.format(record.memory_delta_mb)])
+        for record in active:
+            rows.append([record.stage, record.label, 'running {:.0%}'.format(record.progress), None, None])
+
+        self.timing_table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                self.timing_table.setItem(row, column, QtWidgets.QTableWidgetItem('' if value is None else str(value)))
+
     def on_file_browser_clicked(self,type):
         dlg = Qt.QFileDialog()
         dlg.setFileMode(Qt.QFileDialog.AnyFile)
 
         if dlg.exec_():
             filenames = dlg.selectedFiles()
-            if not self.verify_type(filenames[0]):
+            header = self.verify_type(filenames[0])
+            if not header:
                 self.object_group_box.setTitle('Invalid File Uploaded')
                 self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(255, 0, 0);}')
                 return
@@ -103,26 +185,45 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
                 self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(0, 255, 0);}')
                 self.app.BRAIN_FILE = filenames[0]
                 self.qt_file_name.setText(filenames[0])
+                self.brain_header_label.setText(header.summary())
             else:
                 self.object_group_box.setTitle('Mask File Uploaded')
                 self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(0, 255, 0);}')
                 self.app.MASK_FILE = filenames[0]
                 self.qt_file_name1.setText(filenames[0])
+                # float label maps load fine, an image picked by mistake is caught by its distinct values on load
+                self.mask_header_label.setText(header.summary() + ('  (float values, not a label map?)'
+                                                                   if header.is_float else ''))
 
             
 
     def verify_type(self,file):  
-        ext = os.path.basename(file).split(os.extsep, 1)
-        #print(ext)
-        if 'nii.gz' not in ext[-1]:
-            return False
-        return True
+        # the parsed header of a NIfTI file, None for anything else
+        if not file.endswith(('.nii', '.nii.gz')):
+            return None
+        try:
+            return read_header(file)
+        except (OSError, ValueError):
+            return None
 
     def load_inputs(self):
         if hasattr(self.app,'BRAIN_FILE') and hasattr(self.app,'MASK_FILE'):
+            # headers and the volume index only, a wrong pairing never reaches the pipeline
+            try:
+                problems = pairing_problems(self.app.BRAIN_FILE, self.app.MASK_FILE)
+            except (OSError, ValueError) as error:
+                problems = [str(error)]
+            if problems:
+                self.object_group_box.setTitle('Brain and Mask do not match : ' + '; '.join(problems))
+                self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(255, 0, 0);}')
+                return
             self.object_group_box.setTitle('Rendering... Please Wait')
             self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(0, 255, 0);}')
             self.run()
+            if self.mask.problem:
+                self.object_group_box.setTitle('Mask not rendered : ' + self.mask.problem)
+                self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(255, 0, 0);}')
+                return
             self.object_group_box.setTitle('Render Completed')
             self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(0, 255, 0);}')
         else:
@@ -139,6 +240,8 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
             del self.w2
             self.grid.removeWidget(self.w3)
             del self.w3
+            self.grid.removeWidget(self.w4)
+            del self.w4
         
 
         if not hasattr(self.app,'BRAIN_FILE') or not hasattr(self.app,'MASK_FILE'):
@@ -146,11 +249,15 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
             self.setWindowTitle(APPLICATION_TITLE)
             self.frame.setLayout(self.grid)
             self.setCentralWidget(self.frame)
-            self.set_axial_view()
-            self.interactor.Initialize()
+            self.interactor.Initialize()  # nothing to frame yet, the camera is set once volumes are open
             self.show()
             return
 
+        self.brain_surface_timer.stop()
+        self.mask_surface_timer.stop()
+        self.pipeline_executor.cancel_all()
+        self.slice_panes.setVisible(False)  # the new views widget starts with the panes off
+
         if hasattr(self,'brain_image_prop') and hasattr(self,'brain_slicer_props') and hasattr(self,'slicer_widgets'):
             del self.brain_image_prop
             del self.brain_slicer_props
@@ -162,31 +269,44 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         self.render_window.Render()
         
         
-        self.brain, self.mask = setup_brain(self.renderer, self.app.BRAIN_FILE,self), setup_mask(self.renderer,
-                                                                                            self.app.MASK_FILE,self)
+        self.brain, self.mask = vtkUtils.setup_volumes(self.renderer, self.app.BRAIN_FILE, self.app.MASK_FILE, self)
 
         # setup brain projection and slicer
-        self.brain_image_prop = setup_projection(self.brain, self.renderer,self)
-        self.brain_slicer_props = setup_slicer(self.renderer, self.brain,self)  # causing issues with rotation
+        self.brain_image_prop = vtkUtils.setup_projection(self.brain, self.renderer,self)
+        self.brain_slicer_props = vtkUtils.setup_slicer(self.renderer, self.brain,self)  # causing issues with rotation
         self.slicer_widgets = []
         
-        # brain pickers
+        # brain pickers, a volume reopened from the session keeps its settings
+        brain_label = self.brain.labels[0]
         self.brain_threshold_sp = self.create_new_picker(self.brain.scalar_range[1], self.brain.scalar_range[0], 5.0,
-                                                         sum(self.brain.scalar_range) / 2, self.brain_threshold_vc)
-        self.brain_opacity_sp = self.create_new_picker(1.0, 0.0, 0.1, BRAIN_OPACITY, self.brain_opacity_vc)
-        self.brain_smoothness_sp = self.create_new_picker(1000, 100, 100, BRAIN_SMOOTHNESS, self.brain_smoothness_vc)
-        self.brain_lut_sp = self.create_new_picker(3.0, 0.0, 0.1, 2.0, self.lut_value_changed)
+                                                         self.brain.threshold, self.brain_threshold_vc)
+        self.brain_opacity_sp = self.create_new_picker(1.0, 0.0, 0.1, brain_label.opacity, self.brain_opacity_vc)
+        self.brain_smoothness_sp = self.create_new_picker(1000, 100, 100, brain_label.smoothness,
+                                                          self.brain_smoothness_vc)
+        self.brain_lut_sp = self.create_new_picker(3.0, 0.0, 0.1, self.brain.image_lut.GetValueRange()[1],
+                                                   self.lut_value_changed)
         self.brain_projection_cb = self.add_brain_projection()
         self.brain_slicer_cb = self.add_brain_slicer()
+        self.brain_progressive_cb = QtWidgets.QCheckBox("Progressive")
+        self.brain_progressive_cb.setChecked(PROGRESSIVE_PREVIEW)
+        self.brain_volume_cb = QtWidgets.QCheckBox("Volume Rendering")
+        self.brain_volume_cb.clicked.connect(self.brain_volume_vc)
+        if self.brain.streamed:  # both need the whole volume in memory
+            self.brain_progressive_cb.setChecked(False)
+            self.brain_progressive_cb.setDisabled(True)
+            self.brain_volume_cb.setDisabled(True)
 
         # mask pickers
-        self.mask_opacity_sp = self.create_new_picker(1.0, 0.0, 0.1, MASK_OPACITY, self.mask_opacity_vc)
-        self.mask_smoothness_sp = self.create_new_picker(1000, 100, 100, MASK_SMOOTHNESS, self.mask_smoothness_vc)
+        mask_label = self.mask.labels[0] if self.mask.labels else vtkUtils.NiiLabel(None, MASK_OPACITY, MASK_SMOOTHNESS)
+        self.mask_opacity_sp = self.create_new_picker(1.0, 0.0, 0.1, mask_label.opacity, self.mask_opacity_vc)
+        self.mask_smoothness_sp = self.create_new_picker(1000, 100, 100, mask_label.smoothness,
+                                                         self.mask_smoothness_vc)
         self.mask_label_cbs = []
         
         self.w1 = self.add_brain_settings_widget()
         self.w2 = self.add_mask_settings_widget()
         self.w3 = self.add_views_widget()
+        self.w4 = self.add_export_widget()
         self.show_widgets()
 
         #  set layout and show
@@ -202,15 +322,16 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         self.grid.addWidget(self.w1, 1, 0, 1, 2)
         self.grid.addWidget(self.w2, 2, 0, 2, 2)
         self.grid.addWidget(self.w3, 4, 0, 2, 2)
+        self.grid.addWidget(self.w4, 6, 0, 1, 2)
 
     def lut_value_changed(self):
-        lut = self.brain.image_mapper.GetLookupTable()
+        # only the table changes, the slices on screen are recolored when drawn
+        lut = self.brain.image_lut
         new_lut_value = self.brain_lut_sp.value()
         lut.SetValueRange(0.0, new_lut_value)
         lut.Build()
-        self.brain.image_mapper.SetLookupTable(lut)
-        self.brain.image_mapper.Update()
-        self.render_window.Render()
+        self.slice_panes.refresh()
+        self.render_scheduler.request()
 
     def add_brain_slicer(self):
         slicer_cb = QtWidgets.QCheckBox("Slicer")
@@ -221,7 +342,10 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         object_group_box = QtWidgets.QGroupBox('')
         self.object_group_box = object_group_box
         object_layout = QtWidgets.QVBoxLayout()
-        object_layout.addWidget(self.vtk_widget)
+        object_layout.addWidget(self.vtk_widget, 3)
+        self.slice_panes = SlicePanes()
+        self.slice_panes.setVisible(False)
+        object_layout.addWidget(self.slice_panes, 1)
         object_group_box.setLayout(object_layout)
 
         self.grid.addWidget(object_group_box, 0, 2, 5, 5)
@@ -242,13 +366,15 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         brain_group_layout.addWidget(self.brain_lut_sp, 3, 1, 1, 2)
         brain_group_layout.addWidget(self.brain_projection_cb, 4, 0)
         brain_group_layout.addWidget(self.brain_slicer_cb, 4, 1)
-        brain_group_layout.addWidget(self.create_new_separator(), 5, 0, 1, 3)
-        brain_group_layout.addWidget(QtWidgets.QLabel("Axial Slice"), 6, 0)
-        brain_group_layout.addWidget(QtWidgets.QLabel("Coronal Slice"), 7, 0)
-        brain_group_layout.addWidget(QtWidgets.QLabel("Sagittal Slice"), 8, 0)
+        brain_group_layout.addWidget(self.brain_progressive_cb, 4, 2)
+        brain_group_layout.addWidget(self.brain_volume_cb, 5, 0, 1, 2)
+        brain_group_layout.addWidget(self.create_new_separator(), 6, 0, 1, 3)
+        brain_group_layout.addWidget(QtWidgets.QLabel("Axial Slice"), 7, 0)
+        brain_group_layout.addWidget(QtWidgets.QLabel("Coronal Slice"), 8, 0)
+        brain_group_layout.addWidget(QtWidgets.QLabel("Sagittal Slice"), 9, 0)
 
         slicer_funcs = [self.axial_slice_changed, self.coronal_slice_changed, self.sagittal_slice_changed]
-        current_label_row = 6
+        current_label_row = 7
    
         extent_index = 5
         for func in slicer_funcs:
@@ -267,22 +393,34 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         return brain_group_box
     
     def axial_slice_changed(self):
-        pos = self.slicer_widgets[0].value()
-        self.brain_slicer_props[0].SetDisplayExtent(self.brain.extent[0], self.brain.extent[1], self.brain.extent[2],
-                                                    self.brain.extent[3], pos, pos)
-        self.render_window.Render()
+        self.slice_changed('axial', 0)
 
     def coronal_slice_changed(self):
-        pos = self.slicer_widgets[1].value()
-        self.brain_slicer_props[1].SetDisplayExtent(self.brain.extent[0], self.brain.extent[1], pos, pos,
-                                                    self.brain.extent[4], self.brain.extent[5])
-        self.render_window.Render()
+        self.slice_changed('coronal', 1)
 
     def sagittal_slice_changed(self):
-        pos = self.slicer_widgets[2].value()
-        self.brain_slicer_props[2].SetDisplayExtent(pos, pos, self.brain.extent[2], self.brain.extent[3],
-                                                    self.brain.extent[4], self.brain.extent[5])
-        self.render_window.Render()
+        self.slice_changed('sagittal', 2)
+
+    def slice_changed(self, view, view_idx):
+        position = self.slicer_widgets[view_idx].value()
+        vtkUtils.set_slice_position(self.brain_slicer_props[view_idx], self.brain.extent, view, position)
+        self.slice_panes.set_slice(view, position)
+        if self.brain_slicer_cb.isChecked():  # the panes draw themselves, the 3D scene only shows the slicer
+            self.render_scheduler.request()
+
+    def slice_positions(self):
+        return {view: widget.value() for view, widget in zip(vtkUtils.STANDARD_VIEWS, self.slicer_widgets)}
+
+    def slice_panes_vc(self):
+        panes_checked = self.slice_panes_cb.isChecked()
+        self.slice_panes.setVisible(panes_checked)
+        if panes_checked:
+            self.slice_panes.set_volume(self.brain, self.slice_positions())
+        self.enable_slicer_widgets()
+
+    def enable_slicer_widgets(self):
+        for widget in self.slicer_widgets:
+            widget.setEnabled(self.brain_slicer_cb.isChecked() or self.slice_panes_cb.isChecked())
 
     def add_mask_settings_widget(self):
         mask_settings_group_box = QtWidgets.QGroupBox("Mask Settings")
@@ -300,13 +438,23 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         mask_settings_layout.addWidget(mask_single_color_radio, 2, 1)
         mask_settings_layout.addWidget(self.create_new_separator(), 3, 0, 1, 2)
 
+        # one row per label, its checkbox next to the statistics of the mask sweep
         self.mask_label_cbs = []
-        c_col, c_row = 0, 4  # c_row must always be (+1) of last row
-        for i in range(1, 11):
-            self.mask_label_cbs.append(QtWidgets.QCheckBox("Label {}".format(i)))
-            mask_settings_layout.addWidget(self.mask_label_cbs[i - 1], c_row, c_col)
-            c_row = c_row + 1 if c_col == 1 else c_row
-            c_col = 0 if c_col == 1 else 1
+        self.label_stats_table = QtWidgets.QTableWidget(len(self.mask.labels), 4)
+        self.label_stats_table.setHorizontalHeaderLabels(["Label", "Voxels", "Volume mm³", "Surface mm²"])
+        self.label_stats_table.verticalHeader().setVisible(False)
+        self.label_stats_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.label_stats_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        for i in range(len(self.mask.labels)):
+            self.mask_label_cbs.append(QtWidgets.QCheckBox("Label {}".format(i + 1)))
+            self.label_stats_table.setCellWidget(i, 0, self.mask_label_cbs[i])
+        self.refresh_label_statistics()
+        mask_settings_layout.addWidget(self.label_stats_table, 4, 0, 1, 2)
+
+        export_stats_button = QtWidgets.QPushButton("Export Statistics")
+        export_stats_button.setEnabled(self.mask.statistics is not None)
+        export_stats_button.clicked.connect(self.export_label_statistics)
+        mask_settings_layout.addWidget(export_stats_button, 5, 0, 1, 2)
 
         mask_settings_group_box.setLayout(mask_settings_layout)
 
@@ -318,6 +466,79 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
                 cb.setDisabled(True)
         return mask_settings_group_box
 
+    def refresh_label_statistics(self, label_idx=None):
+        # every row, or the row of the one label whose surface just changed
+        if label_idx is None:
+            rows = vtkUtils.label_statistics_rows(self.mask)
+        else:
+            rows = [row for row in [vtkUtils.label_statistics_row(self.mask, label_idx)] if row is not None]
+        for row in rows:
+            values = [row['voxels'], '{:.1f}'.format(row['volume_mm3']), '{:.1f}'.format(row['surface_mm2'])]
+            for column, value in enumerate(values, 1):
+                self.label_stats_table.setItem(row['label'] - 1, column, QtWidgets.QTableWidgetItem(str(value)))
+
+    def export_label_statistics(self):
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export Label Statistics', 'label_statistics.csv',
+                                                             'CSV (*.csv)')
+        if file_name:
+            vtkUtils.write_label_statistics(self.mask, file_name)
+
+    def add_export_widget(self):
+        export_box = QtWidgets.QGroupBox("Export Meshes")
+        export_layout = QtWidgets.QHBoxLayout()
+        self.export_format_combo = QtWidgets.QComboBox()
+        self.export_format_combo.addItems(meshExport.available_formats())
+        self.export_format_combo.setCurrentText(EXPORT_FORMAT)
+        self.export_quantize_cb = QtWidgets.QCheckBox("Quantize")
+        self.export_quantize_cb.setChecked(EXPORT_QUANTIZE)
+        self.export_button = QtWidgets.QPushButton("Export")
+        self.export_button.clicked.connect(self.export_visible_meshes)
+        export_layout.addWidget(self.export_format_combo)
+        export_layout.addWidget(self.export_quantize_cb)
+        export_layout.addWidget(self.export_button)
+        export_box.setLayout(export_layout)
+        return export_box
+
+    def visible_meshes(self):
+        # surfaces are replaced on rebuild, never changed in place, so the export can keep these while it writes
+        meshes = []
+        brain_label = self.brain.labels[0]
+        if brain_label.mapper and brain_label.actor.GetVisibility() and brain_label.property.GetOpacity() > 0:
+            meshes.append(('brain', brain_label.mapper.GetInput(), brain_label.property.GetColor(), brain_label.property.GetOpacity()))
+        for i, label in enumerate(self.mask.labels):
+            if label.mapper and self.mask_label_cbs[i].isChecked():
+                meshes.append(('label_{}'.format(i + 1), label.mapper.GetInput(), label.property.GetColor(),
+                               label.property.GetOpacity()))
+        return meshes
+
+    def export_visible_meshes(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, 'Export Meshes')
+        if not directory:
+            return
+        meshes = self.visible_meshes()
+        file_format = self.export_format_combo.currentText()
+        quantize = self.export_quantize_cb.isChecked()
+
+        def write():  # runs on the export thread
+            try:
+                self.surface_signals.exported.emit(meshExport.export_meshes(meshes, directory, file_format, quantize))
+            except Exception as error:
+                self.surface_signals.exported.emit(error)
+
+        self.export_button.setDisabled(True)
+        self.object_group_box.setTitle('Exporting {} meshes...'.format(len(meshes)))
+        self.export_executor.submit(write)
+
+    def meshes_exported(self, result):
+        self.export_button.setEnabled(True)
+        if isinstance(result, Exception):
+            self.object_group_box.setTitle('Export failed : {}'.format(result))
+            self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(255, 0, 0);}')
+            return
+        size = sum(os.path.getsize(file) for file in result) / 1024 ** 2
+        self.object_group_box.setTitle('Exported {} files ({:.1f} MB)'.format(len(result), size))
+        self.object_group_box.setStyleSheet('QGroupBox:title {color: rgb(0, 255, 0);}')
+
     def add_views_widget(self):
         axial_view = QtWidgets.QPushButton("Axial")
         coronal_view = QtWidgets.QPushButton("Coronal")
@@ -327,6 +548,9 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         views_box_layout.addWidget(axial_view)
         views_box_layout.addWidget(coronal_view)
         views_box_layout.addWidget(sagittal_view)
+        self.slice_panes_cb = QtWidgets.QCheckBox("Slice Panes")
+        self.slice_panes_cb.clicked.connect(self.slice_panes_vc)
+        views_box_layout.addWidget(self.slice_panes_cb)
         views_box.setLayout(views_box_layout)
 
         axial_view.clicked.connect(self.set_axial_view)
@@ -359,98 +583,189 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
                 self.mask.labels[i].property.SetOpacity(self.mask_opacity_sp.value())
             elif cb.isEnabled():  # labels without data are disabled
                 self.mask.labels[i].property.SetOpacity(0)
-        self.render_window.Render()
+        self.render_scheduler.request()
 
     def mask_single_color_radio_checked(self):
         for label in self.mask.labels:
             if label.property:
                 label.property.SetColor(MASK_COLORS[0])
-        self.render_window.Render()
+        self.render_scheduler.request()
 
     def mask_multi_color_radio_checked(self):
         for label in self.mask.labels:
             if label.property:
                 label.property.SetColor(label.color)
-        self.render_window.Render()
+        self.render_scheduler.request()
 
     def brain_projection_vc(self):
         projection_checked = self.brain_projection_cb.isChecked()
         self.brain_slicer_cb.setDisabled(projection_checked) 
         self.brain_image_prop.SetOpacity(projection_checked)
-        self.render_window.Render()
+        self.render_scheduler.request()
 
     def brain_slicer_vc(self):
         slicer_checked = self.brain_slicer_cb.isChecked()
-
-        for widget in self.slicer_widgets:
-            widget.setEnabled(slicer_checked)
+        self.enable_slicer_widgets()
 
         self.brain_projection_cb.setDisabled(slicer_checked)  
         for prop in self.brain_slicer_props:
             prop.GetProperty().SetOpacity(slicer_checked)
-        self.render_window.Render()
+        self.render_scheduler.request()
+
+    def brain_volume_vc(self):
+        # the ray cast volume replaces the brain surface, threshold and opacity then only edit transfer functions
+        volume_checked = self.brain_volume_cb.isChecked()
+        label = self.brain.labels[0]
+        if volume_checked:
+            self.brain_surface_timer.stop()
+            self.pipeline_executor.cancel(label)
+            self.pipeline_executor.cancel((label, 'preview'))
+            self.brain_volume = vtkUtils.setup_volume_rendering(self.brain, self.renderer, self.brain_threshold_sp.value(),
+                                                       self.brain_opacity_sp.value())
+            self.update_brain_volume()
+        elif self.brain.threshold != self.brain_threshold_sp.value():
+            self.update_brain_surface()  # the threshold moved while the volume was shown
+
+        self.brain_volume.SetVisibility(volume_checked)
+        if label.actor:
+            label.actor.SetVisibility(not volume_checked)
+        self.brain_smoothness_sp.setDisabled(volume_checked)
+        self.brain_progressive_cb.setDisabled(volume_checked)
+        self.render_scheduler.request()
+
+    def update_brain_volume(self):
+        vtkUtils.set_volume_transfer(self.brain.volume.GetProperty(), self.brain.scalar_range, self.brain_threshold_sp.value(),
+                            self.brain_opacity_sp.value(), self.brain.labels[0].color)
 
     def brain_opacity_vc(self):
         opacity = round(self.brain_opacity_sp.value(), 2)
+        self.brain.labels[0].opacity = opacity
         self.brain.labels[0].property.SetOpacity(opacity)
-        self.render_window.Render()
+        if self.brain.volume:
+            self.update_brain_volume()
+        self.render_scheduler.request()
 
     def brain_threshold_vc(self):
-        self.process_changes()
-        threshold = self.brain_threshold_sp.value()
-        self.brain.labels[0].extractor.SetValue(0, threshold)
-        self.render_window.Render()
+        if self.brain_volume_cb.isChecked():
+            self.update_brain_volume()
+            self.render_scheduler.request()
+            return
+        if self.brain_progressive_cb.isChecked():
+            self.update_brain_preview()
+        self.brain_surface_timer.start()
 
     def brain_smoothness_vc(self):
-        self.process_changes()
-        smoothness = self.brain_smoothness_sp.value()
-        self.brain.labels[0].smoother.SetNumberOfIterations(smoothness)
-        self.render_window.Render()
+        self.brain_surface_timer.start()
 
     def mask_opacity_vc(self):
         opacity = round(self.mask_opacity_sp.value(), 2)
         for i, label in enumerate(self.mask.labels):
+            label.opacity = opacity
             if label.property and self.mask_label_cbs[i].isChecked():
                 label.property.SetOpacity(opacity)  
-        self.render_window.Render()
+        self.render_scheduler.request()
 
     def mask_smoothness_vc(self):
-        self.process_changes()
-        smoothness = self.mask_smoothness_sp.value()
-        for label in self.mask.labels:
-            if label.smoother:
-                label.smoother.SetNumberOfIterations(smoothness)
-        self.render_window.Render()
+        self.mask_surface_timer.start()
+
+    def update_brain_surface(self):
+        if not self.brain.labels[0].mapper:
+            return
+        self.brain.labels[0].smoothness = self.brain_smoothness_sp.value()
+        self.submit_surface_job(self.brain, 0, self.brain_threshold_sp.value())
+
+    def update_brain_preview(self):
+        # coarse surface shown right away, replaced by update_brain_surface once the input settles
+        label = self.brain.labels[0]
+        if not label.mapper:
+            return
+        if self.brain.preview_image is None:  # shrunk off the GUI thread the first time, it then shows the preview
+            self.build_brain_preview_image()
+            return
+        if not self.brain.preview_image:  # volume is already small enough to extract interactively
+            return
+
+        stages = vtkUtils.create_surface_stages(self.brain.preview_image, PREVIEW_SMOOTHNESS, self.brain_threshold_sp.value())
+        profiler.set_run(os.path.basename(self.brain.file), *stages, label='preview')
+        self.pipeline_executor.submit((label, 'preview'), stages,
+                                      lambda key, poly_data: self.surface_signals.ready.emit(label, (poly_data, None)))
+
+    def build_brain_preview_image(self):
+        brain = self.brain
+        if brain.preview_image is not None or brain in self.preview_builds:
+            return
+        self.preview_builds.add(brain)
+
+        def build():
+            image = vtkUtils.create_preview_image(brain.reader.GetOutput(), PREVIEW_MAX_VOXELS)
+            self.surface_signals.preview_image.emit(brain, False if image is None else image)
+
+        self.preview_executor.submit(build)
+
+    def preview_image_ready(self, brain, image):
+        self.preview_builds.discard(brain)
+        brain.preview_image = image
+        # only while the full surface is still waiting for the input to settle
+        if brain is self.brain and self.brain_surface_timer.isActive() and self.brain_progressive_cb.isChecked():
+            self.update_brain_preview()
+
+    def update_mask_surfaces(self):
+        if any(label.mapper and label.triangle_budget is None for label in self.mask.labels):
+            vtkUtils.allocate_label_budgets(self.mask)  # all meshes came from the cache so far
+        for label_idx, label in enumerate(self.mask.labels):
+            if label.mapper:
+                label.smoothness = self.mask_smoothness_sp.value()
+                self.submit_surface_job(self.mask, label_idx)
+
+    def submit_surface_job(self, nii_object, label_idx, isovalue=None):
+        label = nii_object.labels[label_idx]
+        self.pipeline_executor.cancel((label, 'preview'))  # a late preview must not replace the full surface
+        cache_key = vtkUtils.surface_cache_key(nii_object, label_idx, isovalue)
+        poly_data = vtkUtils.mesh_cache.get(cache_key)
+        if poly_data is not None:
+            self.pipeline_executor.cancel(label)
+            if isovalue is not None:
+                nii_object.threshold = isovalue
+            self.surface_ready(label, (poly_data, vtkUtils.create_lod_meshes(poly_data)))
+            return
+
+        smoothness = label.smoothness
+
+        def on_done(label, poly_data):  # runs on the worker thread
+            label.checkpoints.record(isovalue, smoothness, stages)
+            if poly_data.GetNumberOfCells():  # an empty mesh would stay in the cache across sessions
+                vtkUtils.mesh_cache.put(cache_key, poly_data)
+            area = vtkUtils.surface_area(poly_data) if isovalue is None else None  # for the statistics panel
+            if isovalue is not None:  # the isovalue of the surface shown, a cancelled job leaves the last one
+                nii_object.threshold = isovalue
+            self.surface_signals.ready.emit(label, (poly_data, vtkUtils.create_lod_meshes(poly_data), area))
+
+        # a streamed brain is contoured again slab by slab inside the job, no volume to update here
+        streamed = label.extractor if nii_object.streamed and isovalue is not None else None
+        if streamed is None:
+            label.source.Update()
+        stages = vtkUtils.create_surface_stages(label.source.GetOutput(), smoothness, isovalue, label.checkpoints,
+                                       label.triangle_budget, streamed, nii_object.block_index)
+        vtkUtils.set_surface_run(nii_object, label_idx, isovalue, *stages)
+        self.pipeline_executor.submit(label, stages, on_done)
+
+    def surface_ready(self, label, surface):
+        vtkUtils.set_label_surface(label, *surface)  # (full mesh, coarser levels or None[, area])
+        if label in self.mask.labels:
+            self.refresh_label_statistics(self.mask.labels.index(label))
+        self.render_scheduler.request()
 
     def set_axial_view(self):
-        self.renderer.ResetCamera()
-        fp = self.renderer.GetActiveCamera().GetFocalPoint()
-        p = self.renderer.GetActiveCamera().GetPosition()
-        dist = math.sqrt((p[0] - fp[0]) ** 2 + (p[1] - fp[1]) ** 2 + (p[2] - fp[2]) ** 2)
-        self.renderer.GetActiveCamera().SetPosition(fp[0], fp[1], fp[2] + dist)
-        self.renderer.GetActiveCamera().SetViewUp(0.0, 1.0, 0.0)
-        self.renderer.GetActiveCamera().Zoom(1.8)
-        self.render_window.Render()
+        vtkUtils.set_standard_view(self.renderer, 'axial')
+        self.render_scheduler.request()
 
     def set_coronal_view(self):
-        self.renderer.ResetCamera()
-        fp = self.renderer.GetActiveCamera().GetFocalPoint()
-        p = self.renderer.GetActiveCamera().GetPosition()
-        dist = math.sqrt((p[0] - fp[0]) ** 2 + (p[1] - fp[1]) ** 2 + (p[2] - fp[2]) ** 2)
-        self.renderer.GetActiveCamera().SetPosition(fp[0], fp[2] - dist, fp[1])
-        self.renderer.GetActiveCamera().SetViewUp(0.0, 0.5, 0.5)
-        self.renderer.GetActiveCamera().Zoom(1.8)
-        self.render_window.Render()
+        vtkUtils.set_standard_view(self.renderer, 'coronal')
+        self.render_scheduler.request()
 
     def set_sagittal_view(self):
-        self.renderer.ResetCamera()
-        fp = self.renderer.GetActiveCamera().GetFocalPoint()
-        p = self.renderer.GetActiveCamera().GetPosition()
-        dist = math.sqrt((p[0] - fp[0]) ** 2 + (p[1] - fp[1]) ** 2 + (p[2] - fp[2]) ** 2)
-        self.renderer.GetActiveCamera().SetPosition(fp[2] + dist, fp[0], fp[1])
-        self.renderer.GetActiveCamera().SetViewUp(0.0, 0.0, 1.0)
-        self.renderer.GetActiveCamera().Zoom(1.6)
-        self.render_window.Render()
+        vtkUtils.set_standard_view(self.renderer, 'sagittal')
+        self.render_scheduler.request()
 
     @staticmethod
     def create_new_separator():
@@ -460,10 +775,19 @@ class MainWindow(QtWidgets.QMainWindow, QtWidgets.QApplication):
         horizontal_line.setStyleSheet("background-color: #c8c8c8;")
         return horizontal_line
 
-    def process_changes(self):
-        for _ in range(10):
-            self.app.processEvents()
-            time.sleep(0.1)
+    @staticmethod
+    def create_debounce_timer(timeout_func):
+        timer = Qt.QTimer()
+        timer.setSingleShot(True)
+        timer.setInterval(PIPELINE_DEBOUNCE_MS)
+        timer.timeout.connect(timeout_func)
+        return timer
+
+    def closeEvent(self, event):
+        self.pipeline_executor.shutdown()
+        self.export_executor.shutdown()
+        self.preview_executor.shutdown()
+        QtWidgets.QMainWindow.closeEvent(self, event)
 
 
 
@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+
+from diskCache import DiskCache, file_hash
+
+
+class MeshCache(DiskCache):
+    """Size-bounded on-disk LRU cache of finished surface meshes (compressed .vtp).
+
+    Keys combine the content hash of the source volume with the pipeline
+    parameters, so an edited file or changed setting never returns a stale mesh.
+    """
+
+    def __init__(self, directory, max_bytes):
+        DiskCache.__init__(self, directory, max_bytes, '.vtp')
+
+    def make_key(self, file, *params):
+        if not self.enabled:
+            return None
+        return hashlib.sha1(repr((file_hash(file),) + params).encode()).hexdigest()
+
+    def contains(self, key):
+        return self.enabled and os.path.exists(self.path(key))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.count(False)
+            return None
+
+        reader = vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        if reader.GetErrorCode():
+            self.count(False)
+            return None
+        self.touch(path)
+        self.count(True)
+        poly_data = vtkPolyData()
+        poly_data.ShallowCopy(reader.GetOutput())
+        return poly_data
+
+    def put(self, key, poly_data):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError:
+            return
+        tmp_path = self.tmp_path(key)
+        writer = vtkXMLPolyDataWriter()
+        writer.SetFileName(tmp_path)
+        writer.SetInputData(poly_data)
+        writer.SetDataModeToBinary()
+        writer.SetCompressorTypeToZLib()
+        if writer.Write():
+            os.replace(tmp_path, self.path(key))
+            self.evict()
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,169 @@
+import json
+import os
+import struct
+
+from vtkmodules.vtkFiltersCore import vtkTriangleFilter
+from vtkmodules.vtkIOGeometry import vtkSTLWriter
+from vtkmodules.vtkIOPLY import vtkPLYWriter
+
+try:
+    import numpy
+    from vtkmodules.util import numpy_support
+except ImportError:  # numpy is optional, glTF export is then unavailable
+    numpy = None
+
+EXPORT_FORMATS = ('glb', 'ply', 'stl')
+
+GLTF_BYTE, GLTF_UNSIGNED_SHORT, GLTF_UNSIGNED_INT, GLTF_FLOAT = 5120, 5123, 5125, 5126
+GLTF_ARRAY_BUFFER, GLTF_ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+
+def available_formats():
+    return [file_format for file_format in EXPORT_FORMATS if file_format != 'glb' or numpy is not None]
+
+
+def triangulate(poly_data):
+    triangles = vtkTriangleFilter()
+    triangles.SetInputData(poly_data)
+    triangles.PassLinesOff()
+    triangles.PassVertsOff()
+    triangles.Update()
+    return triangles.GetOutput()
+
+
+def write_ply(poly_data, file_name, color):
+    writer = vtkPLYWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(poly_data)
+    writer.SetFileTypeToBinary()
+    writer.SetColorModeToUniformColor()
+    writer.SetColor(*[int(round(255 * c)) for c in color])
+    return writer.Write()
+
+
+def write_stl(poly_data, file_name):
+    writer = vtkSTLWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(triangulate(poly_data))
+    writer.SetFileTypeToBinary()
+    return writer.Write()
+
+
+class GlbBuilder:
+    """Collects meshes into one binary glTF 2.0 file.
+
+    Quantized meshes store positions as 16-bit integers on a uniform grid,
+    undone by the node's scale and translation, and normals as normalized
+    bytes (KHR_mesh_quantization), about a third of the float size.
+    """
+
+    def __init__(self, quantize):
+        self.quantize = quantize
+        self.buffer = bytearray()
+        self.gltf = {'asset': {'version': '2.0', 'generator': '3D-Brain-Imaging'}, 'scene': 0,
+                     'scenes': [{'nodes': []}], 'nodes': [], 'meshes': [], 'materials': [],
+                     'accessors': [], 'bufferViews': [], 'buffers': []}
+        if quantize:
+            self.gltf['extensionsUsed'] = self.gltf['extensionsRequired'] = ['KHR_mesh_quantization']
+
+    def add_view(self, data, target, stride=None):
+        while len(self.buffer) % 4:
+            self.buffer.append(0)
+        view = {'buffer': 0, 'byteOffset': len(self.buffer), 'byteLength': data.nbytes, 'target': target}
+        if stride:
+            view['byteStride'] = stride
+        self.buffer += data.tobytes()
+        self.gltf['bufferViews'].append(view)
+        return len(self.gltf['bufferViews']) - 1
+
+    def add_accessor(self, view, component_type, count, accessor_type, normalized=False, bounds=None):
+        accessor = {'bufferView': view, 'componentType': component_type, 'count': count, 'type': accessor_type}
+        if normalized:
+            accessor['normalized'] = True
+        if bounds is not None:
+            accessor['min'], accessor['max'] = bounds
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add_mesh(self, name, poly_data, color, opacity):
+        poly_data = triangulate(poly_data)
+        points = numpy_support.vtk_to_numpy(poly_data.GetPoints().GetData()).astype(numpy.float64)
+        faces = numpy_support.vtk_to_numpy(poly_data.GetPolys().GetConnectivityArray())
+        normals = poly_data.GetPointData().GetNormals()
+        node = {'name': name, 'mesh': len(self.gltf['meshes'])}
+        attributes = {}
+
+        if self.quantize:
+            # one scale for all axes, a non-uniform scale would bend the normals
+            low = points.min(axis=0)
+            scale = max(float((points.max(axis=0) - low).max()) / 65535, 1e-12)
+            grid = numpy.zeros((len(points), 4), numpy.uint16)  # padded to 8 bytes for vertex alignment
+            grid[:, :3] = numpy.rint((points - low) / scale)
+            view = self.add_view(grid, GLTF_ARRAY_BUFFER, 8)
+            bounds = (grid[:, :3].min(axis=0).tolist(), grid[:, :3].max(axis=0).tolist())
+            attributes['POSITION'] = self.add_accessor(view, GLTF_UNSIGNED_SHORT, len(points), 'VEC3', bounds=bounds)
+            node['translation'] = low.tolist()
+            node['scale'] = [scale] * 3
+            if normals is not None:
+                packed = numpy.zeros((len(points), 4), numpy.int8)
+                packed[:, :3] = numpy.rint(numpy.clip(numpy_support.vtk_to_numpy(normals), -1, 1) * 127)
+                view = self.add_view(packed, GLTF_ARRAY_BUFFER, 4)
+                attributes['NORMAL'] = self.add_accessor(view, GLTF_BYTE, len(points), 'VEC3', normalized=True)
+        else:
+            positions = points.astype(numpy.float32)
+            view = self.add_view(positions, GLTF_ARRAY_BUFFER)
+            bounds = (positions.min(axis=0).tolist(), positions.max(axis=0).tolist())
+            attributes['POSITION'] = self.add_accessor(view, GLTF_FLOAT, len(points), 'VEC3', bounds=bounds)
+            if normals is not None:
+                view = self.add_view(numpy_support.vtk_to_numpy(normals).astype(numpy.float32), GLTF_ARRAY_BUFFER)
+                attributes['NORMAL'] = self.add_accessor(view, GLTF_FLOAT, len(points), 'VEC3')
+
+        small = len(points) <= 65535
+        indices = faces.astype(numpy.uint16 if small else numpy.uint32)
+        view = self.add_view(indices, GLTF_ELEMENT_ARRAY_BUFFER)
+        index_accessor = self.add_accessor(view, GLTF_UNSIGNED_SHORT if small else GLTF_UNSIGNED_INT,
+                                           len(indices), 'SCALAR')
+
+        material = {'name': name, 'doubleSided': True,
+                    'pbrMetallicRoughness': {'baseColorFactor': list(color) + [opacity], 'metallicFactor': 0.0}}
+        if opacity < 1:
+            material['alphaMode'] = 'BLEND'
+        self.gltf['materials'].append(material)
+        self.gltf['meshes'].append({'name': name, 'primitives': [
+            {'attributes': attributes, 'indices': index_accessor, 'material': len(self.gltf['materials']) - 1}]})
+        self.gltf['scenes'][0]['nodes'].append(len(self.gltf['nodes']))
+        self.gltf['nodes'].append(node)
+
+    def write(self, file_name):
+        while len(self.buffer) % 4:
+            self.buffer.append(0)
+        self.gltf['buffers'] = [{'byteLength': len(self.buffer)}]
+        document = json.dumps(self.gltf, separators=(',', ':')).encode()
+        document += b' ' * (-len(document) % 4)
+        with open(file_name, 'wb') as f:
+            f.write(struct.pack('<III', 0x46546C67, 2, 12 + 8 + len(document) + 8 + len(self.buffer)))
+            f.write(struct.pack('<II', len(document), 0x4E4F534A) + document)
+            f.write(struct.pack('<II', len(self.buffer), 0x004E4942) + bytes(self.buffer))
+        return True
+
+
+def export_meshes(meshes, directory, file_format, quantize=True):
+    """Writes (name, poly_data, color, opacity) meshes, returns the written files.
+
+    glb puts every mesh in one surfaces.glb, ply and stl write one file per mesh.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meshes = [mesh for mesh in meshes if mesh[1].GetNumberOfCells()]
+    if file_format == 'glb':
+        builder = GlbBuilder(quantize)
+        for name, poly_data, color, opacity in meshes:
+            builder.add_mesh(name, poly_data, color, opacity)
+        file_name = os.path.join(directory, 'surfaces.glb')
+        return [file_name] if builder.write(file_name) else []
+
+    written = []
+    for name, poly_data, color, opacity in meshes:
+        file_name = os.path.join(directory, '{}.{}'.format(name, file_format))
+        if write_ply(poly_data, file_name, color) if file_format == 'ply' else write_stl(poly_data, file_name):
+            written.append(file_name)
+    return written
@@ -0,0 +1,121 @@
+import gzip
+import math
+import struct
+
+NIFTI_TYPE_NAMES = {2: 'uint8', 4: 'int16', 8: 'int32', 16: 'float32', 32: 'complex64', 64: 'float64', 128: 'rgb24',
+                    256: 'int8', 512: 'uint16', 768: 'uint32', 1024: 'int64', 1280: 'uint64', 2304: 'rgba32'}
+NIFTI_FLOAT_TYPES = (16, 32, 64)
+
+
+class NiftiHeader:
+    """Grid, voxel type and orientation of a NIfTI-1 or NIfTI-2 file, read from the header bytes only.
+
+    affine maps voxel indices to world millimetres from the sform, else the
+    qform, else the voxel spacing alone, as the NIfTI standard orders them.
+    """
+
+    def __init__(self, file, version, dims, spacing, datatype, bitpix, qform_code, sform_code, affine):
+        self.file = file
+        self.version = version
+        self.dims = dims  # voxels along x, y, z (and t when 4D)
+        self.spacing = spacing
+        self.datatype = datatype
+        self.bitpix = bitpix
+        self.qform_code = qform_code
+        self.sform_code = sform_code
+        self.affine = affine  # 3 rows of 4
+
+    @property
+    def type_name(self):
+        return NIFTI_TYPE_NAMES.get(self.datatype, 'type {}'.format(self.datatype))
+
+    @property
+    def is_float(self):
+        return self.datatype in NIFTI_FLOAT_TYPES
+
+    @property
+    def orientation(self):
+        # world direction each voxel axis points to, 'RAS' when x, y, z run right, anterior, superior
+        codes = ''
+        for column in range(3):
+            axis = max(range(3), key=lambda row: abs(self.affine[row][column]))
+            codes += 'RAS'[axis] if self.affine[axis][column] >= 0 else 'LPI'[axis]
+        return codes
+
+    def summary(self):
+        return '{}  {} mm  {}  {}'.format(' x '.join(map(str, self.dims)),
+                                          ' x '.join('{:.3g}'.format(s) for s in self.spacing),
+                                          self.type_name, self.orientation)
+
+
+def quaternion_affine(b, c, d, qfac, spacing, offset):
+    a = math.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+    rotation = [[a * a + b * b - c * c - d * d, 2 * (b * c - a * d), 2 * (b * d + a * c)],
+                [2 * (b * c + a * d), a * a + c * c - b * b - d * d, 2 * (c * d - a * b)],
+                [2 * (b * d - a * c), 2 * (c * d + a * b), a * a + d * d - c * c - b * b]]
+    scale = [spacing[0], spacing[1], spacing[2] * (-1 if qfac < 0 else 1)]
+    return [[rotation[row][column] * scale[column] for column in range(3)] + [offset[row]] for row in range(3)]
+
+
+def read_header(file):
+    """Parses the header of file (.nii or .nii.gz), only its first bytes are read or inflated.
+
+    Raises ValueError when the file is not NIfTI.
+    """
+    with (gzip.open if file.endswith('.gz') else open)(file, 'rb') as f:
+        data = f.read(540)
+
+    for endian in '<>':
+        if len(data) >= 4 and struct.unpack(endian + 'i', data[:4])[0] in (348, 540):
+            break
+    else:
+        raise ValueError('not a NIfTI file : ' + file)
+
+    def unpack(fmt, offset):
+        return struct.unpack_from(endian + fmt, data, offset)
+
+    if unpack('i', 0)[0] == 348:
+        if data[344:347] not in (b'n+1', b'ni1'):
+            raise ValueError('not a NIfTI-1 file : ' + file)
+        dim = unpack('8h', 40)
+        datatype, bitpix = unpack('2h', 70)
+        pixdim = unpack('8f', 76)
+        qform_code, sform_code = unpack('2h', 252)
+        quaternion = unpack('6f', 256)
+        srows = unpack('12f', 280)
+        version = 1
+    else:
+        if len(data) < 540 or data[4:7] not in (b'n+2', b'ni2'):
+            raise ValueError('not a NIfTI-2 file : ' + file)
+        datatype, bitpix = unpack('2h', 12)
+        dim = unpack('8q', 16)
+        pixdim = unpack('8d', 104)
+        qform_code, sform_code = unpack('2i', 344)
+        quaternion = unpack('6d', 352)
+        srows = unpack('12d', 400)
+        version = 2
+
+    n_dims = max(1, min(dim[0], 7))
+    dims = tuple(dim[1:n_dims + 1])
+    spacing = tuple(abs(s) for s in pixdim[1:4])
+    if sform_code > 0:
+        affine = [list(srows[0:4]), list(srows[4:8]), list(srows[8:12])]
+    elif qform_code > 0:
+        affine = quaternion_affine(*quaternion[:3], pixdim[0], spacing, quaternion[3:])
+    else:
+        affine = [[spacing[0], 0, 0, 0], [0, spacing[1], 0, 0], [0, 0, spacing[2], 0]]
+    return NiftiHeader(file, version, dims, spacing, datatype, bitpix, qform_code, sform_code, affine)
+
+
+def grid_mismatches(brain, mask, tolerance=1e-3):
+    # reasons the mask voxels would not land on the brain voxels, empty when they do
+    problems = []
+    if brain.dims[:3] != mask.dims[:3]:
+        problems.append('size {} vs {}'.format(' x '.join(map(str, brain.dims[:3])),
+                                               ' x '.join(map(str, mask.dims[:3]))))
+    if any(abs(b - m) > tolerance * max(b, m) for b, m in zip(brain.spacing, mask.spacing)):
+        problems.append('spacing {} vs {} mm'.format(' x '.join('{:.3g}'.format(s) for s in brain.spacing),
+                                                     ' x '.join('{:.3g}'.format(s) for s in mask.spacing)))
+    if brain.orientation != mask.orientation:
+        problems.append('orientation {} vs {}'.format(brain.orientation, mask.orientation))
+    return problems
@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from vtkmodules.vtkCommonCore import vtkCommand
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+
+
+class PipelineJob:
+    def __init__(self, key, stages, on_done):
+        self.key = key
+        self.stages = stages
+        self.on_done = on_done
+        self.cancelled = False
+        self.failed = False  # a stage reported an error, e.g. an exception in a Python algorithm
+        self.current = None
+
+    def cancel(self):
+        self.cancelled = True
+        stage = self.current
+        if stage is not None:
+            stage.SetAbortExecute(1)  # makes a long running filter (e.g. the smoother) return early
+
+    def stage_failed(self, caller, event):
+        self.failed = True
+
+    def run(self):
+        for stage in self.stages:
+            stage.AddObserver(vtkCommand.ErrorEvent, self.stage_failed)
+        for stage in self.stages:
+            self.current = stage
+            if self.cancelled or self.failed:
+                return
+            stage.Update()
+        self.current = None
+        if self.cancelled or self.failed:
+            return  # the surface on screen stays, an empty result would replace it
+
+        # hand over a copy so the job pipeline can be released by the worker
+        output = vtkPolyData()
+        output.ShallowCopy(self.stages[-1].GetOutput())
+        self.on_done(self.key, output)
+
+
+class PipelineExecutor:
+    """Runs surface pipeline stages on worker threads, one live job per key.
+
+    Submitting a job for a key cancels the job still pending or running for it,
+    on_done(key, polydata) is called from the worker thread.
+    """
+
+    def __init__(self, max_workers=1):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, stages, on_done):
+        job = PipelineJob(key, stages, on_done)
+        with self.lock:
+            stale_job = self.jobs.get(key)
+            if stale_job is not None:
+                stale_job.cancel()
+            self.jobs[key] = job
+        self.pool.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        try:
+            job.run()
+        finally:
+            with self.lock:
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+
+    def cancel(self, key):
+        with self.lock:
+            job = self.jobs.pop(key, None)
+            if job is not None:
+                job.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancel()
+            self.jobs.clear()
+
+    def shutdown(self):
+        self.cancel_all()
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,41 @@
+import time
+
+from PyQt5 import Qt
+
+
+class RenderScheduler:
+    """Coalesces render requests of the Qt callbacks into at most max_fps frames a second.
+
+    request() only marks the scene dirty, the render runs from the event loop
+    once the frame interval has passed, so a dragged slider renders its latest
+    value instead of queueing a frame per step. Requests folded into a frame
+    that was already pending are counted as coalesced.
+    """
+
+    def __init__(self, render_window, max_fps=60):
+        self.render_window = render_window
+        self.interval = 1.0 / max_fps
+        self.last_render = 0.0
+        self.requested = 0
+        self.rendered = 0
+        self.coalesced = 0
+        self.timer = Qt.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.render)
+
+    def request(self):
+        self.requested += 1
+        if self.timer.isActive():
+            self.coalesced += 1
+            return
+        wait = self.last_render + self.interval - time.perf_counter()
+        self.timer.start(max(0, int(wait * 1000)))
+
+    def render(self):
+        self.timer.stop()
+        self.render_window.Render()
+        self.last_render = time.perf_counter()
+        self.rendered += 1
+
+    def stats(self):
+        return {'requested': self.requested, 'rendered': self.rendered, 'coalesced': self.coalesced}
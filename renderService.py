@@ -0,0 +1,219 @@
+"""Local render service for standard-view snapshots.
+
+Loads brain/mask pairs with the vtkUtils pipeline and answers with PNG
+snapshots rendered offscreen, so thumbnails need neither Qt nor a display.
+
+    python3 renderService.py --port 8600 -j 4
+
+    GET /snapshot?brain=T1.nii.gz&mask=mask.nii.gz&view=coronal&size=256
+    GET /snapshot?brain=...&mask=...&view=axial&axial=80&opacity=0
+    GET /stats
+
+view is axial, coronal or sagittal. axial, coronal and sagittal given as
+voxel indices show those brain slices, opacity overrides the brain surface
+opacity (0 hides it). Every worker process owns one offscreen render window
+and keeps the pairs it rendered last loaded (vtkUtils.session), a pair is
+always sent to the same worker so repeated requests find it warm.
+
+Rendering goes through whatever offscreen OpenGL VTK was built with, set
+VTK_DEFAULT_OPENGL_WINDOW=vtkOSOpenGLRenderWindow for software OSMesa or
+vtkEGLRenderWindow for EGL.
+"""
+import argparse
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from vtkmodules.vtkCommonCore import vtkMultiThreader, vtkSMPTools
+from vtkmodules.vtkIOImage import vtkPNGWriter
+from vtkmodules.vtkRenderingCore import vtkRenderWindow, vtkRenderer, vtkWindowToImageFilter
+
+import vtkUtils
+from config import *
+from volumeIndex import pairing_problems
+
+
+class SnapshotScene:
+    """One offscreen renderer and the brain/mask pair it shows, stands in for the viewer window."""
+
+    def __init__(self):
+        self.renderer = vtkRenderer()
+        self.renderer.SetBackground(*SNAPSHOT_BACKGROUND)
+        self.render_window = vtkRenderWindow()
+        self.render_window.SetOffScreenRendering(True)
+        self.render_window.SetMultiSamples(0)  # multisampling triples the frame time of software OpenGL
+        self.render_window.AddRenderer(self.renderer)
+        self.window_image = vtkWindowToImageFilter()
+        self.window_image.SetInput(self.render_window)
+        self.window_image.ReadFrontBufferOff()
+        self.window_image.ShouldRerenderOff()  # read back the frame rendered for the snapshot
+        self.brain = None
+        self.mask = None
+        self.slicers = []
+
+    def show(self, brain_file, mask_file):
+        brain, mask = vtkUtils.load_volumes(brain_file, mask_file)
+        if brain is not self.brain:
+            self.brain = vtkUtils.show_brain(self.renderer, brain, self)
+            self.slicers = vtkUtils.setup_slicer(self.renderer, brain, self)
+        if mask is not self.mask:
+            self.mask = vtkUtils.show_mask(self.renderer, mask, self)
+
+    def snapshot(self, view, size, slices, opacity=None):
+        brain_label = self.brain.labels[0]
+        if brain_label.property:
+            brain_label.property.SetOpacity(brain_label.opacity if opacity is None else opacity)
+        for slicer, slice_view in zip(self.slicers, vtkUtils.STANDARD_VIEWS):
+            slicer.SetVisibility(slice_view in slices)
+            slicer.GetProperty().SetOpacity(1 if slice_view in slices else 0)  # the slicer props start transparent
+            if slice_view in slices:
+                vtkUtils.set_slice_position(slicer, self.brain.extent, slice_view, slices[slice_view])
+
+        self.render_window.SetSize(size, size)
+        vtkUtils.set_standard_view(self.renderer, view)
+        self.render_window.Render()
+        self.window_image.Modified()
+        png_writer = vtkPNGWriter()  # a writer keeps appending to its in-memory result
+        png_writer.SetInputConnection(self.window_image.GetOutputPort())
+        png_writer.WriteToMemoryOn()
+        png_writer.Write()
+        return bytes(png_writer.GetResult())
+
+
+scene = None  # of this worker process
+
+
+def init_worker(threads):
+    global scene
+    vtkMultiThreader.SetGlobalMaximumNumberOfThreads(threads)
+    vtkSMPTools.Initialize(threads)
+    vtkUtils.PIPELINE_WORKERS = threads  # label chains of a mask, also bounded by the worker's share
+    scene = SnapshotScene()
+
+
+def render_snapshot(brain_file, mask_file, view, size, slices, opacity):
+    scene.show(brain_file, mask_file)
+    if scene.mask.problem:
+        raise ValueError('mask not rendered : ' + scene.mask.problem)
+    return scene.snapshot(view, size, slices, opacity)
+
+
+def worker_stats():
+    stats = vtkUtils.session.stats()
+    stats['pid'] = os.getpid()
+    return stats
+
+
+class RenderPool:
+    """Worker processes with one render window each, requests for a pair always go to the same worker."""
+
+    def __init__(self, workers, threads_per_worker=1):
+        self.workers = [ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(threads_per_worker,))
+                        for _ in range(workers)]
+
+    def submit(self, brain_file, mask_file, *args):
+        worker = self.workers[zlib.crc32('{}\n{}'.format(brain_file, mask_file).encode()) % len(self.workers)]
+        return worker.submit(render_snapshot, brain_file, mask_file, *args)
+
+    def stats(self):
+        return [worker.submit(worker_stats).result() for worker in self.workers]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown(cancel_futures=True)
+
+
+def parse_snapshot_query(query, root):
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    files = []
+    for kind in ('brain', 'mask'):
+        if kind not in params:
+            raise ValueError('missing ' + kind)
+        file = os.path.realpath(os.path.join(root, params[kind]))
+        if os.path.commonpath([file, root]) != root:
+            raise ValueError(kind + ' is outside the data directory')
+        if not os.path.isfile(file):
+            raise FileNotFoundError(params[kind])
+        files.append(file)
+    problems = pairing_problems(*files)
+    if problems:
+        raise ValueError('brain and mask do not match : ' + '; '.join(problems))
+
+    view = params.get('view', 'axial')
+    if view not in vtkUtils.STANDARD_VIEWS:
+        raise ValueError('view must be one of ' + ', '.join(vtkUtils.STANDARD_VIEWS))
+    size = int(params.get('size', SNAPSHOT_SIZE))
+    if not 16 <= size <= SNAPSHOT_MAX_SIZE:
+        raise ValueError('size must be between 16 and {}'.format(SNAPSHOT_MAX_SIZE))
+    slices = {slice_view: int(params[slice_view]) for slice_view in vtkUtils.STANDARD_VIEWS if slice_view in params}
+    opacity = float(params['opacity']) if 'opacity' in params else None
+    return files + [view, size, slices, opacity]
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    pool = None
+    root = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self.reply(200, 'application/json', json.dumps(self.pool.stats()).encode())
+        if url.path != '/snapshot':
+            return self.reply(404, 'text/plain', b'unknown path')
+        try:
+            args = parse_snapshot_query(url.query, self.root)
+        except FileNotFoundError as error:
+            return self.reply(404, 'text/plain', 'no such file : {}'.format(error).encode())
+        except ValueError as error:
+            return self.reply(400, 'text/plain', str(error).encode())
+        try:
+            png = self.pool.submit(*args).result()
+        except ValueError as error:
+            return self.reply(400, 'text/plain', str(error).encode())
+        except Exception as error:
+            return self.reply(500, 'text/plain', repr(error).encode())
+        self.reply(200, 'image/png', png)
+
+    def reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Serve offscreen PNG snapshots of brain and mask surfaces.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=RENDER_SERVICE_PORT)
+    parser.add_argument('-j', '--workers', type=int, default=RENDER_SERVICE_WORKERS, help='number of render processes')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='VTK threads inside each worker')
+    parser.add_argument('--root', default='.', help='brain and mask paths are resolved inside this directory')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    SnapshotHandler.pool = RenderPool(args.workers, args.threads_per_worker)
+    SnapshotHandler.root = os.path.realpath(args.root)
+    server = ThreadingHTTPServer((args.host, args.port), SnapshotHandler)
+    print('Serving snapshots on http://{}:{}/snapshot'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        SnapshotHandler.pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
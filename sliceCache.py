@@ -0,0 +1,84 @@
+from collections import OrderedDict
+
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkImagingCore import vtkExtractVOI, vtkImageMapToColors
+
+SLICE_AXES = {'axial': 2, 'coronal': 1, 'sagittal': 0}
+
+
+class SliceCache:
+    """Colored voxel planes of one volume for the 2D slice panes.
+
+    A slice is cut from the source and mapped through the shared lookup table
+    once, then kept until max_slices newer ones push it out. Changing the
+    table drops every slice. prefetch() queues the neighbours of the slice
+    on screen and prefetch_next() colors one of them, so scrolling on finds
+    them ready.
+    """
+
+    def __init__(self, source, lut, max_slices=128):
+        self.source = source  # algorithm output of the volume, streamed readers only read the plane
+        self.lut = lut
+        self.lut_time = lut.GetMTime()
+        self.max_slices = max_slices
+        self.slices = OrderedDict()  # (view, index) -> RGB vtkImageData
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+        self.source.UpdateInformation()
+        self.extent = self.source.GetDataExtent()
+        self.voi = vtkExtractVOI()
+        self.voi.SetInputConnection(self.source.GetOutputPort())
+        self.colors = vtkImageMapToColors()
+        self.colors.SetInputConnection(self.voi.GetOutputPort())
+        self.colors.SetLookupTable(lut)
+        self.colors.SetOutputFormatToRGB()
+
+    def slice_range(self, view):
+        axis = SLICE_AXES[view]
+        return self.extent[2 * axis], self.extent[2 * axis + 1]
+
+    def check_lut(self):
+        if self.lut.GetMTime() != self.lut_time:
+            self.lut_time = self.lut.GetMTime()
+            self.slices.clear()
+
+    def get(self, view, index):
+        self.check_lut()
+        key = (view, index)
+        if key in self.slices:
+            self.hits += 1
+            self.slices.move_to_end(key)
+            return self.slices[key]
+        self.misses += 1
+        return self.color_slice(view, index)
+
+    def color_slice(self, view, index):
+        axis = SLICE_AXES[view]
+        extent = list(self.extent)
+        extent[2 * axis] = extent[2 * axis + 1] = index
+        self.voi.SetVOI(*extent)
+        self.colors.Update()
+        image = vtkImageData()
+        image.DeepCopy(self.colors.GetOutput())
+        self.slices[(view, index)] = image
+        while len(self.slices) > self.max_slices:
+            self.slices.popitem(last=False)
+        return image
+
+    def prefetch(self, view, index, step, count):
+        # the next slices in the scroll direction first, then the ones behind
+        low, high = self.slice_range(view)
+        ahead = [index + step * i for i in range(1, count + 1)]
+        behind = [index - step * i for i in range(1, count // 2 + 1)]
+        self.pending = [(view, i) for i in ahead + behind if low <= i <= high]
+
+    def prefetch_next(self):
+        self.check_lut()
+        while self.pending:
+            key = self.pending.pop(0)
+            if key not in self.slices:
+                self.color_slice(*key)
+                return True
+        return False
@@ -0,0 +1,101 @@
+import PyQt5.QtWidgets as QtWidgets
+from PyQt5 import Qt
+from vtkmodules.vtkCommonDataModel import vtkDataObject
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleImage
+from vtkmodules.vtkRenderingCore import vtkImageActor, vtkRenderer
+from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+
+from config import *
+from renderScheduler import RenderScheduler
+from sliceCache import SLICE_AXES, SliceCache
+
+# camera direction and view up of each pane, looking at the plane from outside the volume
+PANE_CAMERAS = {'axial': ((0, 0, 1), (0, 1, 0)),
+                'coronal': ((0, -1, 0), (0, 0, 1)),
+                'sagittal': ((1, 0, 0), (0, 0, 1))}
+
+
+class SlicePane:
+    """One 2D view of a single slice, with its own render window so the 3D scene is left alone."""
+
+    def __init__(self, view):
+        self.view = view
+        self.index = None
+        self.widget = QVTKRenderWindowInteractor()
+        self.renderer = vtkRenderer()
+        self.render_window = self.widget.GetRenderWindow()
+        self.render_window.AddRenderer(self.renderer)
+        self.widget.GetRenderWindow().GetInteractor().SetInteractorStyle(vtkInteractorStyleImage())
+        self.actor = vtkImageActor()
+        self.actor.InterpolateOff()
+        self.renderer.AddActor(self.actor)
+        self.renderer.GetActiveCamera().ParallelProjectionOn()
+        self.render_scheduler = RenderScheduler(self.render_window, RENDER_MAX_FPS)
+
+    def show_slice(self, image, index):
+        self.index = index
+        self.actor.SetInputData(image)
+        self.actor.SetDisplayExtent(image.GetExtent())  # the image actor would otherwise show its z = 0 plane
+        self.renderer.ResetCameraClippingRange()
+        self.render_scheduler.request()
+
+    def reset_camera(self, bounds):
+        direction, view_up = PANE_CAMERAS[self.view]
+        center = [(bounds[2 * axis] + bounds[2 * axis + 1]) / 2 for axis in range(3)]
+        camera = self.renderer.GetActiveCamera()
+        camera.SetFocalPoint(center)
+        camera.SetPosition([c + d for c, d in zip(center, direction)])
+        camera.SetViewUp(view_up)
+        self.renderer.ResetCamera(bounds)
+        up_axis = view_up.index(1)
+        camera.SetParallelScale(0.55 * (bounds[2 * up_axis + 1] - bounds[2 * up_axis]))  # fill the pane height
+
+
+class SlicePanes(QtWidgets.QWidget):
+    """Axial, coronal and sagittal panes over one SliceCache, a slice change redraws only its pane."""
+
+    def __init__(self):
+        QtWidgets.QWidget.__init__(self)
+        self.cache = None
+        self.panes = {view: SlicePane(view) for view in SLICE_AXES}
+        layout = QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        for pane in self.panes.values():
+            layout.addWidget(pane.widget)
+        self.setLayout(layout)
+
+        # neighbouring slices are colored one per event loop pass, between the user's input
+        self.prefetch_timer = Qt.QTimer()
+        self.prefetch_timer.setInterval(0)
+        self.prefetch_timer.timeout.connect(self.prefetch_next)
+
+    def set_volume(self, nii_object, positions):
+        self.prefetch_timer.stop()
+        self.cache = SliceCache(nii_object.reader, nii_object.image_lut, SLICE_CACHE_SLICES)
+        origin = nii_object.reader.GetOutputInformation(0).Get(vtkDataObject.ORIGIN())
+        spacing = nii_object.reader.GetOutputInformation(0).Get(vtkDataObject.SPACING())
+        bounds = [origin[i // 2] + spacing[i // 2] * nii_object.extent[i] for i in range(6)]
+        for view, pane in self.panes.items():
+            pane.index = None
+            pane.reset_camera(bounds)
+            self.set_slice(view, positions[view])
+
+    def set_slice(self, view, index):
+        if self.cache is None or not self.isVisible():
+            return
+        pane = self.panes[view]
+        step = 1 if pane.index is None or index >= pane.index else -1
+        pane.show_slice(self.cache.get(view, index), index)
+        self.cache.prefetch(view, index, step, SLICE_PREFETCH)
+        self.prefetch_timer.start()
+
+    def refresh(self):
+        # after a lookup table change, the cache drops its slices on the next get
+        for view, pane in self.panes.items():
+            if pane.index is not None:
+                pane.index, index = None, pane.index
+                self.set_slice(view, index)
+
+    def prefetch_next(self):
+        if not self.cache.prefetch_next():
+            self.prefetch_timer.stop()
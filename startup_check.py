@@ -0,0 +1,86 @@
+"""Startup import budget check.
+
+Imports main in fresh interpreters and fails when the import takes longer
+than the budget, or when a module meant to load with the first volumes is
+already imported at startup.
+
+    python3 startup_check.py                 # exit 1 on regression
+    python3 startup_check.py --budget 0.4 --runs 10
+
+The fastest of the runs is compared, the others mostly measure a cold disk
+cache. The slowest imports made by main in the last run are listed to show
+what to defer.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from config import *
+
+# loaded on the first file open, never by the empty window
+DEFERRED_MODULES = ['vtkUtils', 'meshExport', 'labelStats', 'blockIndex', 'streamedSurface', 'volumeCache',
+                    'vtkmodules.vtkIOXML', 'vtkmodules.vtkRenderingVolume', 'vtkmodules.vtkRenderingImage',
+                    'vtkmodules.vtkImagingStatistics', 'vtkmodules.vtkIOPLY', 'vtkmodules.vtkIOGeometry']
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+loaded = [name for name, module in sys.modules.items() if type(module).__name__ != '_LazyModule']
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(loaded)}))
+'''
+
+
+def import_main(importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', IMPORT_SCRIPT]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def slowest_imports(importtime_log, count):
+    # imports made by main itself in the -X importtime log, cumulative microseconds
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if len(name) - len(name.lstrip()) == 3:  # every nesting level indents by two more
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Check the time it takes to import the viewer.')
+    parser.add_argument('--budget', type=float, default=STARTUP_IMPORT_BUDGET, help='seconds allowed for import main')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters, the fastest is compared')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    runs = [import_main()[0] for _ in range(args.runs - 1)]
+    last, importtime_log = import_main(importtime=True)
+    seconds = min(run['seconds'] for run in runs) if runs else last['seconds']
+
+    print('import main : {:.3f}s (budget {:.3f}s)'.format(seconds, args.budget))
+    for cumulative, name in slowest_imports(importtime_log, args.top):
+        print('  {:<40} {:.3f}s'.format(name, cumulative))
+
+    failed = False
+    early = [module for module in DEFERRED_MODULES if module in last['modules']]
+    if early:
+        print('Imported at startup : ' + ', '.join(early))
+        failed = True
+    if seconds > args.budget:
+        print('Startup import is over budget')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkAppendPolyData, vtkDecimatePro, vtkFlyingEdges3D, vtkStaticCleanPolyData
+from vtkmodules.vtkFiltersGeneral import vtkDiscreteMarchingCubes
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+
+def slab_extents(extent, slab_voxels, shared=True):
+    # z slabs of about slab_voxels, shared neighbours have a common boundary plane so no cell is lost
+    x0, x1, y0, y1, z0, z1 = extent
+    depth = max(1, slab_voxels // ((x1 - x0 + 1) * (y1 - y0 + 1)) - 1)
+    z = z0
+    while True:
+        end = min(z + depth, z1)
+        yield [x0, x1, y0, y1, z, end]
+        if end == z1:
+            return
+        z = end if shared else end + 1
+
+
+def read_slabs(reader, slab_voxels, extent=None):
+    """Reads the volume one slab at a time, only the slab being yielded is resident.
+
+    Slabs do not overlap, every voxel is seen once. The yielded image is reused
+    by the next slab, copy what has to outlive it.
+    """
+    reader.UpdateInformation()
+    for slab in slab_extents(extent or reader.GetDataExtent(), slab_voxels, shared=False):
+        reader.UpdateExtent(slab)
+        yield reader.GetOutput()
+
+
+class StreamedSurface(VTKPythonAlgorithmBase):
+    """Contours a volume slab by slab for volumes that do not fit in memory.
+
+    Every slab is contoured and decimated on its own, keeping the cut boundary,
+    then the pieces are appended and the vertices on the shared planes welded.
+    open_reader returns a new, not yet updated reader, so every execution
+    streams through its own reader and may run on any thread.
+    """
+
+    def __init__(self, open_reader, discrete=False, slab_voxels=256 ** 3, extent=None, reduction=0.5):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkPolyData')
+        self.open_reader = open_reader
+        self.discrete = discrete
+        self.slab_voxels = slab_voxels
+        self.extent = extent
+        self.reduction = reduction
+        self.value = 0.0
+
+    def clone(self):
+        return StreamedSurface(self.open_reader, self.discrete, self.slab_voxels, self.extent, self.reduction)
+
+    def SetValue(self, index, value):
+        if value != self.value:
+            self.value = value
+            self.Modified()
+
+    def GetValue(self, index):
+        return self.value
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestData(self, request, inInfo, outInfo):
+        contour = vtkDiscreteMarchingCubes() if self.discrete else vtkFlyingEdges3D()
+        contour.SetValue(0, self.value)
+        reducer = vtkDecimatePro()
+        reducer.SetInputConnection(contour.GetOutputPort())
+        reducer.SetTargetReduction(self.reduction)
+        reducer.PreserveTopologyOn()
+        reducer.BoundaryVertexDeletionOff()  # the cut edges have to meet the next slab
+        append = vtkAppendPolyData()
+
+        reader = self.open_reader()
+        reader.UpdateInformation()
+        slabs = list(slab_extents(self.extent or reader.GetDataExtent(), self.slab_voxels))
+        for index, slab in enumerate(slabs):
+            if self.GetAbortExecute():
+                return 1
+            reader.UpdateExtent(slab)
+            contour.SetInputData(reader.GetOutput())
+            contour.Update()
+            if contour.GetOutput().GetNumberOfCells():
+                reducer.Update()
+                piece = vtkPolyData()
+                piece.DeepCopy(reducer.GetOutput())
+                append.AddInputData(piece)
+            self.UpdateProgress((index + 1) / len(slabs))
+
+        output = vtkPolyData.GetData(outInfo)
+        if not append.GetNumberOfInputConnections(0):
+            output.Initialize()
+            return 1
+        weld = vtkStaticCleanPolyData()
+        weld.SetInputConnection(append.GetOutputPort())
+        weld.SetTolerance(0.0)  # vertices of neighbouring slabs are computed from the same voxels
+        weld.Update()
+        output.ShallowCopy(weld.GetOutput())
+        return 1
@@ -0,0 +1,27 @@
+import pytest
+
+import benchmark
+
+STAGES = ['read', 'extract', 'decimate', 'smooth', 'smooth_sinc', 'normals']
+
+
+@pytest.mark.parametrize('kind', ['brain', 'mask'])
+def test_case_measures_every_stage(kind, tmp_path):
+    file_name = benchmark.write_synthetic_volume(24, kind, str(tmp_path))
+    result = benchmark.run_case(file_name, kind, smoothness=5)
+    assert result['kind'] == kind and result['dimensions'] == [24, 24, 24]
+    assert list(result['stages']) == STAGES
+    assert all(stage['seconds'] >= 0 and stage['peak_rss_mb'] > 0 for stage in result['stages'].values())
+    assert result['stages']['extract']['cells'] > 0
+    assert result['stages']['decimate']['cells'] < result['stages']['extract']['cells']
+
+
+def test_compare_flags_only_real_slowdowns():
+    def results(**seconds):
+        return {'cases': {'T1': {'stages': {name: {'seconds': value} for name, value in seconds.items()}}}}
+
+    baseline = results(read=1.0, extract=0.01, smooth=2.0)
+    current = results(read=1.05, extract=0.03, smooth=3.0, normals=1.0)
+    # read is within tolerance, extract only slower by less than min_seconds, normals has no baseline
+    assert benchmark.compare(current, baseline, tolerance=0.1, min_seconds=0.05) == [('T1', 'smooth')]
+    assert benchmark.compare(results(read=1.0), {'cases': {}}, 0.1, 0.05) == []
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from vtkmodules.vtkFiltersCore import vtkFeatureEdges, vtkFlyingEdges3D
+
+import vtkUtils
+from blockIndex import BlockIndex, BlockSurface
+
+numpy = pytest.importorskip('numpy', reason='the block index needs numpy')
+from vtkmodules.util import numpy_support  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+
+def open_edges(poly_data):
+    # boundary plus non-manifold edges, a closed surface has none
+    edges = vtkFeatureEdges()
+    edges.SetInputData(poly_data)
+    edges.BoundaryEdgesOn()
+    edges.NonManifoldEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+    return edges.GetOutput().GetNumberOfCells()
+
+
+@pytest.mark.parametrize('file_name, isovalue, max_active', [
+    ('FLAIR.nii.gz', 415, 0.1), ('FLAIR.nii.gz', 415.5, 0.1), ('FLAIR.nii.gz', 664, 0.1), ('FLAIR.nii.gz', 788, 0.1),
+    ('FLAIR.nii.gz', 166, 1.0), ('FLAIR.nii.gz', 166.5, 1.0), ('T1.nii.gz', 1780, 0.1), ('T1.nii.gz', 936.5, 0.1),
+    ('T1.nii.gz', 468.3, 1.0)])
+def test_block_surface_matches_whole_volume(file_name, isovalue, max_active):
+    image = vtkUtils.read_volume(os.path.join(DATA_DIR, file_name)).GetOutput()
+    whole = vtkFlyingEdges3D()
+    whole.SetInputData(image)
+    whole.SetValue(0, isovalue)
+    whole.Update()
+    blocks = BlockSurface(BlockIndex.build(image, 16), max_active)
+    blocks.SetInputDataObject(image)
+    blocks.SetValue(0, isovalue)
+    blocks.Update()
+
+    assert blocks.GetOutput().GetNumberOfCells() == whole.GetOutput().GetNumberOfCells()
+    assert blocks.GetOutput().GetNumberOfPoints() == whole.GetOutput().GetNumberOfPoints()
+    assert open_edges(blocks.GetOutput()) == open_edges(whole.GetOutput())
+
+
+@pytest.mark.parametrize('file_name, isovalue', [('T1.nii.gz', 341), ('FLAIR.nii.gz', 166)])
+def test_block_surface_falls_back_to_whole_volume(file_name, isovalue):
+    image = vtkUtils.read_volume(os.path.join(DATA_DIR, file_name)).GetOutput()
+    whole = vtkFlyingEdges3D()
+    whole.SetInputData(image)
+    whole.SetValue(0, isovalue)
+    whole.Update()
+    blocks = BlockSurface(BlockIndex.build(image, 16), 0.1)
+    blocks.SetInputDataObject(image)
+    blocks.SetValue(0, isovalue)
+    blocks.Update()
+
+    assert blocks.active_fraction > 0.1
+    assert numpy.array_equal(numpy_support.vtk_to_numpy(blocks.GetOutput().GetPoints().GetData()),
+                             numpy_support.vtk_to_numpy(whole.GetOutput().GetPoints().GetData()))
+    assert numpy.array_equal(numpy_support.vtk_to_numpy(blocks.GetOutput().GetPolys().GetConnectivityArray()),
+                             numpy_support.vtk_to_numpy(whole.GetOutput().GetPolys().GetConnectivityArray()))
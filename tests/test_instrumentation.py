@@ -0,0 +1,78 @@
+import json
+
+from vtkmodules.vtkFiltersCore import vtkTriangleFilter
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+
+from instrumentation import PipelineProfiler
+
+
+def sphere_pipeline(profiler):
+    source = profiler.watch(vtkSphereSource(), 'source')
+    source.SetThetaResolution(16)
+    source.SetPhiResolution(16)
+    triangles = profiler.watch(vtkTriangleFilter(), 'triangles')
+    triangles.SetInputConnection(source.GetOutputPort())
+    return source, triangles
+
+
+def test_records_every_executed_stage():
+    profiler = PipelineProfiler()
+    source, triangles = sphere_pipeline(profiler)
+    profiler.set_run(3, source, triangles, label='sphere')
+    triangles.Update()
+    output = triangles.GetOutput()
+
+    records, active = profiler.breakdown()
+    assert active == []
+    assert profiler.last_run == 3
+    assert [record.stage for record in records] == ['source', 'triangles']
+    record = profiler.latest[(3, 'triangles', 'sphere')]
+    assert record.class_name == 'vtkTriangleFilter'
+    assert record.seconds >= 0 and record.progress == 1.0
+    assert record.points == output.GetNumberOfPoints()
+    assert record.cells == output.GetNumberOfCells()
+    assert record.output_kb == output.GetActualMemorySize()
+
+
+def test_breakdown_keeps_only_the_latest_run():
+    profiler = PipelineProfiler()
+    source, triangles = sphere_pipeline(profiler)
+    profiler.set_run(1, source, triangles)
+    triangles.Update()
+    profiler.set_run(2, source, triangles)
+    source.Modified()
+    triangles.Update()
+
+    records, _ = profiler.breakdown()
+    assert {record.run for record in records} == {2}
+    assert len(records) == 2
+
+
+def test_disabled_profiler_does_not_observe():
+    profiler = PipelineProfiler(enabled=False)
+    source = profiler.watch(vtkSphereSource(), 'source')
+    source.Update()
+    assert profiler.tags == {} and profiler.latest == {}
+
+
+def test_log_file_holds_stages_and_notes(tmp_path):
+    log_file = str(tmp_path / 'profile.jsonl')
+    profiler = PipelineProfiler(log_file=log_file)
+    source, triangles = sphere_pipeline(profiler)
+    profiler.set_run(7, source, triangles)
+    triangles.Update()
+    profiler.note(7, triangle_budget=1000)
+
+    with open(log_file) as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry['stage'] for entry in entries] == ['source', 'triangles', 'note']
+    assert all(entry['run'] == 7 and 'time' in entry for entry in entries)
+    assert entries[-1]['triangle_budget'] == 1000
+
+
+def test_deleted_algorithms_are_forgotten():
+    profiler = PipelineProfiler()
+    source = profiler.watch(vtkSphereSource(), 'source')
+    assert len(profiler.tags) == 1
+    del source
+    assert profiler.tags == {}
@@ -0,0 +1,136 @@
+
+import pytest
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkImagingCore import vtkExtractVOI
+from vtkmodules.vtkIOImage import vtkNIFTIImageWriter
+
+import vtkUtils
+from config import MASK_MAX_LABELS
+import labelStats
+from labelStats import LabelStatistics, label_extents, label_values
+from volumeIndex import pairing_problems
+
+numpy = pytest.importorskip('numpy', reason='the label statistics need numpy')
+from vtkmodules.util import numpy_support  # noqa: E402
+
+
+def make_image(voxels, spacing=(1, 1, 1), origin=(0, 0, 0)):
+    # (z, y, x) array as vtkImageData
+    image = vtkImageData()
+    image.SetDimensions(*voxels.shape[::-1])
+    image.SetSpacing(*spacing)
+    image.SetOrigin(*origin)
+    image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(), deep=True))
+    return image
+
+
+def write_nifti(voxels, file):
+    writer = vtkNIFTIImageWriter()
+    writer.SetInputData(make_image(voxels))
+    writer.SetFileName(file)
+    writer.Write()
+    return file
+
+
+def atlas(shape=(24, 24, 24), values=(2, 17, 1000, 2035)):
+    voxels = numpy.zeros(shape, numpy.int16)
+    for index, value in enumerate(values):
+        voxels[2 + 5 * index:5 + 5 * index, 4:20, 3:9] = value
+    return voxels
+
+
+def random_labels(shape=(13, 17, 19), n_labels=6, seed=1):
+    # blobs of labels with a gap in the values, label 4 is never used
+    voxels = numpy.random.default_rng(seed).integers(0, n_labels + 1, shape).astype(numpy.uint8)
+    voxels[voxels == 4] = 0
+    voxels[:3] = 0
+    return voxels
+
+
+def expected_statistics(voxels, spacing, origin, n_labels):
+    # per label value: count, centroid in mm and voxel (x, y, z) min/max, straight from numpy
+    expected = {}
+    for value in range(1, n_labels + 1):
+        z, y, x = numpy.nonzero(voxels == value)
+        if not len(x):
+            continue
+        indices = numpy.stack([x, y, z])
+        expected[value] = (len(x), numpy.asarray(origin) + numpy.asarray(spacing) * indices.mean(axis=1),
+                           indices.min(axis=1), indices.max(axis=1))
+    return expected
+
+
+def test_statistics_match_numpy():
+    voxels = random_labels()
+    spacing, origin = (0.5, 1.25, 2.0), (-10.0, 3.0, 7.5)
+    rows = LabelStatistics(6).add(make_image(voxels, spacing, origin)).rows()
+    expected = expected_statistics(voxels, spacing, origin, 6)
+
+    assert [row['label'] for row in rows] == sorted(expected) == [1, 2, 3, 5, 6]
+    for row in rows:
+        count, centroid, lows, highs = expected[row['label']]
+        assert row['voxels'] == count
+        assert row['volume_mm3'] == pytest.approx(count * 0.5 * 1.25 * 2.0)
+        assert [row['centroid_x'], row['centroid_y'], row['centroid_z']] == pytest.approx(centroid)
+        assert [row['voxel_x_min'], row['voxel_y_min'], row['voxel_z_min']] == list(lows)
+        assert [row['voxel_x_max'], row['voxel_y_max'], row['voxel_z_max']] == list(highs)
+
+
+def test_statistics_of_slabs_match_the_whole_volume():
+    image = make_image(random_labels(), (0.5, 1.25, 2.0), (-10.0, 3.0, 7.5))
+    slabs = LabelStatistics(6)
+    for z0, z1 in [(0, 4), (5, 9), (10, 12)]:
+        extract = vtkExtractVOI()
+        extract.SetInputData(image)
+        extract.SetVOI(0, 18, 0, 16, z0, z1)
+        extract.Update()
+        slabs.add(extract.GetOutput())
+    whole = LabelStatistics(6).add(image)
+
+    assert len(slabs.rows()) == len(whole.rows())
+    for slab_row, whole_row in zip(slabs.rows(), whole.rows()):
+        assert slab_row == pytest.approx(whole_row)
+    assert slabs.extents(image.GetExtent(), 2) == whole.extents(image.GetExtent(), 2)
+
+
+def test_label_extents_are_padded_and_clipped(monkeypatch):
+    voxels = numpy.zeros((10, 10, 10), numpy.int16)
+    voxels[0:2, 4:6, 8:10] = 1
+    voxels[5, 5, 5] = 3
+    image = make_image(voxels)
+
+    assert label_extents(image, 3, pad=1) == {1: [7, 9, 3, 6, 0, 2], 3: [4, 6, 4, 6, 4, 6]}
+    monkeypatch.setattr(labelStats, 'numpy', None)  # without numpy every label with voxels keeps the whole extent
+    assert label_extents(image, 3, pad=1) == {1: [0, 9, 0, 9, 0, 9], 3: [0, 9, 0, 9, 0, 9]}
+
+
+def test_label_values_counts_distinct_values():
+    assert label_values(make_image(atlas()), MASK_MAX_LABELS) == {2, 17, 1000, 2035}
+    noise = numpy.random.default_rng(0).uniform(0, 500, (20, 20, 20)).astype(numpy.float32)
+    assert len(label_values(make_image(noise), 100)) == 101
+
+
+def test_label_values_without_numpy(monkeypatch):
+    image = make_image(atlas())
+    monkeypatch.setattr(labelStats, 'numpy', None)
+    assert label_values(image, MASK_MAX_LABELS) == {2, 17, 1000, 2035}
+    assert label_values(image, 2) == {2, 17, 1000}
+
+
+def test_load_mask_keeps_atlas_label_values_above_the_limit(tmp_path):
+    mask = vtkUtils.load_mask(write_nifti(atlas(), str(tmp_path / 'atlas.nii')))
+    assert mask.problem is None
+    assert len(mask.labels) == 2035
+    assert [label_idx + 1 for label_idx, label in enumerate(mask.labels) if label.extractor] == [2, 17, 1000, 2035]
+    rows = vtkUtils.label_statistics_rows(mask)
+    assert [row['label'] for row in rows] == [2, 17, 1000, 2035]
+    assert all(row['surface_mm2'] > 0 for row in rows)
+
+
+def test_load_mask_reports_an_image_picked_by_mistake(tmp_path):
+    noise = numpy.random.default_rng(0).integers(0, 3000, (24, 24, 24)).astype(numpy.int16)
+    file = write_nifti(noise, str(tmp_path / 'image.nii'))
+    mask = vtkUtils.load_mask(file)
+    assert mask.labels == []
+    assert 'distinct values' in mask.problem
+    assert pairing_problems(file, file) == [mask.problem]  # the next pairing is rejected before loading
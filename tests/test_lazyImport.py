@@ -0,0 +1,42 @@
+import sys
+
+from lazyImport import lazy_import
+import startup_check
+
+
+def test_module_executes_on_first_attribute_access(tmp_path, monkeypatch):
+    (tmp_path / 'lazyProbe.py').write_text('import sys\nsys.lazy_probe_runs = getattr(sys, "lazy_probe_runs", 0) + 1\nvalue = 42\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazyProbe', raising=False)
+    monkeypatch.setattr(sys, 'lazy_probe_runs', 0, raising=False)
+
+    module = lazy_import('lazyProbe')
+    assert sys.lazy_probe_runs == 0
+    assert module.value == 42
+    assert sys.lazy_probe_runs == 1
+    assert lazy_import('lazyProbe') is module
+    module.value
+    assert sys.lazy_probe_runs == 1
+
+
+def test_imported_module_is_returned_as_is():
+    import json
+    assert lazy_import('json') is json
+
+
+def test_slowest_imports_lists_direct_imports_of_main():
+    log = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       100 |        100 |   config',
+        'import time:        50 |         50 |     vtkmodules.vtkCommonMath',
+        'import time:       200 |     300000 |   vtkmodules.vtkRenderingCore',
+        'import time:        10 |       2000 |   lazyImport',
+        'import time:       500 |     400000 | main',
+    ])
+    assert startup_check.slowest_imports(log, 2) == [(0.3, 'vtkmodules.vtkRenderingCore'), (0.002, 'lazyImport')]
+
+
+def test_main_defers_the_pipeline_modules():
+    result, _ = startup_check.import_main()
+    early = [module for module in startup_check.DEFERRED_MODULES if module in result['modules']]
+    assert early == []
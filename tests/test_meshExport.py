@@ -0,0 +1,108 @@
+import json
+import os
+import struct
+
+import pytest
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+from vtkmodules.vtkIOGeometry import vtkSTLReader
+from vtkmodules.vtkIOPLY import vtkPLYReader
+
+from meshExport import export_meshes
+
+numpy = pytest.importorskip('numpy', reason='glTF export needs numpy')
+from vtkmodules.util import numpy_support  # noqa: E402
+
+COMPONENT_DTYPES = {5120: numpy.int8, 5123: numpy.uint16, 5125: numpy.uint32, 5126: numpy.float32}
+TYPE_SIZES = {'SCALAR': 1, 'VEC3': 3}
+
+
+def sphere(resolution, center):
+    source = vtkSphereSource()
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution)
+    source.SetRadius(12.5)
+    source.SetCenter(*center)
+    source.Update()
+    return source.GetOutput()
+
+
+def meshes():
+    # the second sphere has more than 65535 points, its indices need 32 bits
+    return [('small', sphere(24, (10, -20, 30)), (1, 0, 0), 1.0), ('large', sphere(300, (-40, 5, 0)), (0, 1, 0), 0.5)]
+
+
+def read_glb(file_name):
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    magic, version, length = struct.unpack_from('<III', data, 0)
+    assert (magic, version, length) == (0x46546C67, 2, len(data))
+    json_length, json_type = struct.unpack_from('<II', data, 12)
+    assert json_type == 0x4E4F534A and json_length % 4 == 0
+    bin_offset = 20 + json_length
+    bin_length, bin_type = struct.unpack_from('<II', data, bin_offset)
+    assert bin_type == 0x004E4942 and bin_length % 4 == 0
+    assert bin_offset + 8 + bin_length == len(data)
+    return json.loads(data[20:bin_offset]), data[bin_offset + 8:]
+
+
+def accessor_data(gltf, buffer, accessor_idx):
+    accessor = gltf['accessors'][accessor_idx]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    dtype = numpy.dtype(COMPONENT_DTYPES[accessor['componentType']])
+    size = TYPE_SIZES[accessor['type']]
+    stride = view.get('byteStride', dtype.itemsize * size)
+    rows = numpy.frombuffer(buffer, numpy.uint8, accessor['count'] * stride, view['byteOffset'])
+    return rows.reshape(-1, stride)[:, :dtype.itemsize * size].copy().view(dtype).reshape(-1, size)
+
+
+@pytest.mark.parametrize('quantize', [False, True])
+def test_glb_layout(tmp_path, quantize):
+    written = export_meshes(meshes(), str(tmp_path), 'glb', quantize)
+    assert written == [os.path.join(str(tmp_path), 'surfaces.glb')]
+    gltf, buffer = read_glb(written[0])
+
+    assert gltf['buffers'] == [{'byteLength': len(buffer)}]
+    for view in gltf['bufferViews']:
+        assert view['byteOffset'] % 4 == 0
+        assert view.get('byteStride', 4) % 4 == 0
+        assert view['byteOffset'] + view['byteLength'] <= len(buffer)
+    assert ('KHR_mesh_quantization' in gltf.get('extensionsRequired', [])) == quantize
+
+    for (name, poly_data, color, opacity), node, mesh in zip(meshes(), gltf['nodes'], gltf['meshes']):
+        primitive = mesh['primitives'][0]
+        position_idx = primitive['attributes']['POSITION']
+        positions = accessor_data(gltf, buffer, position_idx)
+        accessor = gltf['accessors'][position_idx]
+        assert accessor['min'] == positions.min(axis=0).tolist()
+        assert accessor['max'] == positions.max(axis=0).tolist()
+
+        # back in world coordinates every point is within half a grid step of the original
+        points = numpy_support.vtk_to_numpy(poly_data.GetPoints().GetData())
+        world = positions * node.get('scale', [1, 1, 1]) + node.get('translation', [0, 0, 0])
+        tolerance = node['scale'][0] / 2 + 1e-6 if quantize else 1e-5
+        assert numpy.abs(world - points).max() <= tolerance
+
+        normals = accessor_data(gltf, buffer, primitive['attributes']['NORMAL']).astype(numpy.float64)
+        if quantize:
+            normals /= 127
+        assert numpy.abs(numpy.linalg.norm(normals, axis=1) - 1).max() < 0.02
+
+        indices = accessor_data(gltf, buffer, primitive['indices']).ravel()
+        assert indices.dtype == (numpy.uint16 if len(points) <= 65535 else numpy.uint32)
+        assert len(indices) == 3 * poly_data.GetNumberOfCells()
+        assert indices.max() < len(points)
+
+        material = gltf['materials'][primitive['material']]
+        assert material['pbrMetallicRoughness']['baseColorFactor'] == list(color) + [opacity]
+        assert ('alphaMode' in material) == (opacity < 1)
+
+
+@pytest.mark.parametrize('file_format, reader_type', [('ply', vtkPLYReader), ('stl', vtkSTLReader)])
+def test_ply_and_stl_keep_the_triangles(tmp_path, file_format, reader_type):
+    written = export_meshes(meshes(), str(tmp_path), file_format)
+    assert [os.path.basename(file) for file in written] == ['small.' + file_format, 'large.' + file_format]
+    for file, (name, poly_data, color, opacity) in zip(written, meshes()):
+        reader = reader_type()
+        reader.SetFileName(file)
+        reader.Update()
+        assert reader.GetOutput().GetNumberOfCells() == poly_data.GetNumberOfCells()
@@ -0,0 +1,102 @@
+import gzip
+import os
+import struct
+
+import pytest
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkCommonCore import VTK_FLOAT, VTK_SHORT
+from vtkmodules.vtkIOImage import vtkNIFTIImageReader, vtkNIFTIImageWriter
+
+from niftiHeader import grid_mismatches, read_header
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+
+
+def write_volume(file, dims, spacing, scalar_type, version):
+    image = vtkImageData()
+    image.SetDimensions(*dims)
+    image.SetSpacing(*spacing)
+    image.AllocateScalars(scalar_type, 1)
+    writer = vtkNIFTIImageWriter()
+    writer.SetNIFTIVersion(version)
+    writer.SetInputData(image)
+    writer.SetFileName(file)
+    writer.Write()
+    return file
+
+
+def nifti1_bytes(endian, dims, spacing, quaternion, qfac):
+    # a bare NIfTI-1 header with only a qform, as scanners write them
+    header = bytearray(352)
+    struct.pack_into(endian + 'i', header, 0, 348)
+    struct.pack_into(endian + '8h', header, 40, 3, *dims, 1, 1, 1, 1)
+    struct.pack_into(endian + '2h', header, 70, 4, 16)
+    struct.pack_into(endian + '8f', header, 76, qfac, *spacing, 1, 1, 1, 1)
+    struct.pack_into(endian + 'f', header, 108, 352)
+    struct.pack_into(endian + '2h', header, 252, 1, 0)
+    struct.pack_into(endian + '6f', header, 256, *quaternion, 0, 0, 0)
+    header[344:348] = b'n+1\0'
+    return bytes(header)
+
+
+@pytest.mark.parametrize('file_name', ['T1.nii.gz', 'FLAIR.nii.gz', 'mask.nii.gz'])
+def test_header_matches_vtk_reader(file_name):
+    file = os.path.join(DATA_DIR, file_name)
+    reader = vtkNIFTIImageReader()
+    reader.SetFileName(file)
+    reader.Update()
+    header = read_header(file)
+
+    assert header.version == 1
+    assert header.dims == reader.GetOutput().GetDimensions()
+    assert header.spacing == pytest.approx(reader.GetOutput().GetSpacing())
+
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('suffix', ['.nii', '.nii.gz'])
+def test_header_of_written_volume(tmp_path, version, suffix):
+    file = write_volume(str(tmp_path / ('volume' + suffix)), (7, 5, 3), (0.5, 1.5, 2.0), VTK_SHORT, version)
+    header = read_header(file)
+
+    assert header.version == version
+    assert header.dims == (7, 5, 3)
+    assert header.spacing == pytest.approx((0.5, 1.5, 2.0))
+    assert header.type_name == 'int16'
+    assert not header.is_float
+
+
+def test_header_of_float_nifti2(tmp_path):
+    header = read_header(write_volume(str(tmp_path / 'float.nii'), (4, 4, 4), (1, 1, 1), VTK_FLOAT, 2))
+    assert header.type_name == 'float32'
+    assert header.is_float
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_qform_orientation_in_either_byte_order(tmp_path, endian):
+    # 180 degrees about z turns x to left and y to posterior, qfac -1 flips z to inferior
+    file = tmp_path / 'qform.nii.gz'
+    with gzip.open(str(file), 'wb') as f:
+        f.write(nifti1_bytes(endian, (10, 20, 30), (1.0, 2.0, 3.0), (0, 0, 1), -1))
+    header = read_header(str(file))
+
+    assert header.dims == (10, 20, 30)
+    assert header.orientation == 'LPI'
+    assert [row[column] for row, column in zip(header.affine, range(3))] == pytest.approx([-1.0, -2.0, -3.0])
+
+
+def test_not_nifti(tmp_path):
+    file = tmp_path / 'notes.nii'
+    file.write_bytes(b'not a header' * 50)
+    with pytest.raises(ValueError):
+        read_header(str(file))
+
+
+def test_grid_mismatches(tmp_path):
+    brain = read_header(write_volume(str(tmp_path / 'brain.nii'), (8, 8, 8), (1, 1, 1), VTK_SHORT, 1))
+    same = read_header(write_volume(str(tmp_path / 'same.nii'), (8, 8, 8), (1, 1, 1), VTK_SHORT, 2))
+    other = read_header(write_volume(str(tmp_path / 'other.nii'), (8, 8, 4), (1, 1, 2), VTK_SHORT, 1))
+
+    assert grid_mismatches(brain, same) == []
+    problems = grid_mismatches(brain, other)
+    assert len(problems) == 2
+    assert problems[0].startswith('size') and problems[1].startswith('spacing')
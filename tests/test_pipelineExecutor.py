@@ -0,0 +1,126 @@
+import threading
+import time
+
+from vtkmodules.vtkCommonDataModel import vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkTriangleFilter
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+from pipelineExecutor import PipelineExecutor
+
+
+class GateSource(VTKPythonAlgorithmBase):
+    """Sphere source that waits for its gate to open, or for the job to abort it."""
+
+    def __init__(self, gate=None, fail=False):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkPolyData')
+        self.gate = gate
+        self.fail = fail
+        self.started = threading.Event()
+        self.aborted = False
+
+    def RequestData(self, request, inInfo, outInfo):
+        self.started.set()
+        while self.gate is not None and not self.gate.wait(0.01):
+            if self.GetAbortExecute():
+                self.aborted = True
+                return 1
+        if self.fail:
+            raise RuntimeError('stage failed')
+        sphere = vtkSphereSource()
+        sphere.Update()
+        vtkPolyData.GetData(outInfo).ShallowCopy(sphere.GetOutput())
+        return 1
+
+
+def stages(gate=None, fail=False):
+    source = GateSource(gate, fail)
+    triangles = vtkTriangleFilter()
+    triangles.SetInputConnection(source.GetOutputPort())
+    return [source, triangles]
+
+
+def collect():
+    done = []
+    return done, lambda key, poly_data: done.append((key, poly_data.GetNumberOfCells()))
+
+
+def drain(executor):
+    # waits for every submitted job, shutdown() would cancel them
+    executor.pool.shutdown(wait=True)
+
+
+def test_job_output_reaches_on_done():
+    executor = PipelineExecutor(1)
+    done, on_done = collect()
+    executor.submit('brain', stages(), on_done)
+    drain(executor)
+    assert done == [('brain', 96)]
+
+
+def test_submit_replaces_the_pending_job_of_a_key():
+    executor = PipelineExecutor(1)
+    gate = threading.Event()
+    done, on_done = collect()
+    executor.submit('busy', stages(gate), on_done)  # holds the only worker
+    first = stages()
+    executor.submit('label', first, on_done)
+    executor.submit('label', stages(), on_done)
+    gate.set()
+    drain(executor)
+
+    assert done == [('busy', 96), ('label', 96)]
+    assert not first[0].started.is_set()  # the replaced job never ran a stage
+
+
+def test_cancel_aborts_the_running_stage():
+    executor = PipelineExecutor(1)
+    done, on_done = collect()
+    job_stages = stages(threading.Event())
+    executor.submit('label', job_stages, on_done)
+    assert job_stages[0].started.wait(5)
+    executor.cancel('label')
+    drain(executor)
+
+    assert job_stages[0].aborted
+    assert done == []
+
+
+def test_cancel_all_drops_pending_jobs():
+    executor = PipelineExecutor(1)
+    gate = threading.Event()
+    done, on_done = collect()
+    running = stages(gate)
+    executor.submit('busy', running, on_done)
+    pending = [stages() for _ in range(3)]
+    for key, job_stages in enumerate(pending):
+        executor.submit(key, job_stages, on_done)
+    assert running[0].started.wait(5)
+    executor.cancel_all()
+    gate.set()
+    drain(executor)
+
+    assert done == []
+    assert not any(job_stages[0].started.is_set() for job_stages in pending)
+
+
+def test_failed_stage_gives_no_result():
+    executor = PipelineExecutor(1)
+    done, on_done = collect()
+    job = executor.submit('label', stages(fail=True), on_done)
+    drain(executor)
+    assert job.failed
+    assert done == []
+
+
+def test_finished_jobs_leave_no_entries():
+    executor = PipelineExecutor(2)
+    done, on_done = collect()
+    for key in range(4):
+        executor.submit(key, stages(), on_done)
+    deadline = time.time() + 5
+    while len(done) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(done) == [(key, 96) for key in range(4)]
+    assert executor.jobs == {}
+    executor.shutdown()
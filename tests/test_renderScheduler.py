@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+Qt = pytest.importorskip('PyQt5.Qt', reason='the render scheduler runs on the Qt event loop')
+
+from renderScheduler import RenderScheduler  # noqa: E402
+
+
+class CountingWindow:
+    def __init__(self):
+        self.renders = 0
+
+    def Render(self):
+        self.renders += 1
+
+
+@pytest.fixture(scope='module')
+def app():
+    return Qt.QCoreApplication.instance() or Qt.QCoreApplication([])
+
+
+def process_events(app, seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def test_requests_in_one_frame_render_once(app):
+    window = CountingWindow()
+    scheduler = RenderScheduler(window, max_fps=20)
+    for _ in range(10):
+        scheduler.request()
+    assert window.renders == 0
+    process_events(app, 0.1)
+    assert window.renders == 1
+    assert scheduler.stats() == {'requested': 10, 'rendered': 1, 'coalesced': 9}
+
+
+def test_next_frame_waits_for_the_interval(app):
+    window = CountingWindow()
+    scheduler = RenderScheduler(window, max_fps=10)
+    scheduler.render()
+    scheduler.request()
+    process_events(app, 0.05)
+    assert window.renders == 1
+    process_events(app, 0.15)
+    assert window.renders == 2
+    assert scheduler.stats()['coalesced'] == 0
+
+
+def test_direct_render_cancels_the_pending_frame(app):
+    window = CountingWindow()
+    scheduler = RenderScheduler(window, max_fps=20)
+    scheduler.request()
+    scheduler.render()
+    process_events(app, 0.1)
+    assert window.renders == 1
@@ -0,0 +1,30 @@
+"""Offscreen snapshots of the sample data, needs an offscreen OpenGL window
+(e.g. VTK_DEFAULT_OPENGL_WINDOW=vtkEGLRenderWindow) on a machine without a display."""
+import os
+
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkIOImage import vtkPNGReader
+
+import renderService
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+
+
+def lit_pixels(png):
+    reader = vtkPNGReader()
+    reader.SetMemoryBuffer(png)
+    reader.SetMemoryBufferLength(len(png))
+    reader.Update()
+    pixels = numpy_support.vtk_to_numpy(reader.GetOutput().GetPointData().GetScalars())
+    return int((pixels[:, :3].max(axis=1) > 0).sum())
+
+
+def test_slice_parameters_show_the_slice():
+    scene = renderService.SnapshotScene()
+    scene.show(os.path.join(DATA_DIR, 'T1.nii.gz'), os.path.join(DATA_DIR, 'mask.nii.gz'))
+    for label in scene.mask.labels:
+        if label.actor:
+            label.actor.SetVisibility(False)  # the labels would cover the slice
+    assert lit_pixels(scene.snapshot('axial', 128, {}, opacity=0)) == 0
+    # the middle axial slice of the head fills a good part of the view
+    assert lit_pixels(scene.snapshot('axial', 128, {'axial': 96}, opacity=0)) > 0.3 * 128 * 128
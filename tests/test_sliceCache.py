@@ -0,0 +1,90 @@
+import pytest
+from vtkmodules.vtkCommonCore import VTK_SHORT, vtkLookupTable
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkNIFTIImageReader, vtkNIFTIImageWriter
+
+from sliceCache import SliceCache
+
+numpy = pytest.importorskip('numpy')
+from vtkmodules.util import numpy_support  # noqa: E402
+
+
+def make_source(directory, shape=(6, 5, 4)):
+    # reader of a (z, y, x) ramp volume, the voxel value encodes its index
+    image = vtkImageData()
+    image.SetDimensions(*shape[::-1])
+    image.AllocateScalars(VTK_SHORT, 1)
+    numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())[:] = numpy.arange(numpy.prod(shape))
+    writer = vtkNIFTIImageWriter()
+    writer.SetInputData(image)
+    writer.SetFileName(str(directory / 'ramp.nii'))
+    writer.Write()
+    reader = vtkNIFTIImageReader()
+    reader.SetFileName(str(directory / 'ramp.nii'))
+    return reader
+
+
+def gray_table(high):
+    lut = vtkLookupTable()
+    lut.SetRange(0, high)
+    lut.SetSaturationRange(0, 0)
+    lut.SetValueRange(0, 1)
+    lut.SetRampToLinear()
+    lut.Build()
+    return lut
+
+
+def rgb(image):
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+@pytest.mark.parametrize('view, expected', [
+    ('axial', lambda ramp, index: ramp[index]), ('coronal', lambda ramp, index: ramp[:, index]),
+    ('sagittal', lambda ramp, index: ramp[:, :, index])])
+def test_slices_are_colored_planes_of_the_volume(tmp_path, view, expected):
+    lut = gray_table(119)
+    cache = SliceCache(make_source(tmp_path), lut)
+    ramp = numpy.arange(120).reshape(6, 5, 4)
+    image = cache.get(view, 2)
+
+    colors = []
+    for value in expected(ramp, 2).ravel():
+        color = [0.0, 0.0, 0.0]
+        lut.GetColor(value, color)
+        colors.append(color)
+    colors = 255 * numpy.array(colors)
+    assert rgb(image).shape == (len(colors), 3)
+    assert numpy.abs(rgb(image) - colors).max() <= 1
+
+
+def test_slices_are_kept_until_pushed_out(tmp_path):
+    cache = SliceCache(make_source(tmp_path), gray_table(119), max_slices=2)
+    first = cache.get('axial', 0)
+    assert cache.get('axial', 0) is first
+    cache.get('axial', 1)
+    cache.get('axial', 2)
+    assert ('axial', 0) not in cache.slices
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_lookup_table_change_drops_slices(tmp_path):
+    lut = gray_table(119)
+    cache = SliceCache(make_source(tmp_path), lut)
+    first = cache.get('coronal', 1)
+    lut.SetRange(0, 60)
+    lut.Build()
+    second = cache.get('coronal', 1)
+    assert second is not first
+    assert not numpy.array_equal(rgb(first), rgb(second))
+
+
+def test_prefetch_colors_the_slices_ahead_first(tmp_path):
+    cache = SliceCache(make_source(tmp_path), gray_table(119))
+    cache.prefetch('axial', 2, 1, 4)
+    assert cache.pending == [('axial', 3), ('axial', 4), ('axial', 5), ('axial', 1), ('axial', 0)]
+    cache.get('axial', 4)
+    colored = 0
+    while cache.prefetch_next():
+        colored += 1
+    assert colored == 4
+    assert cache.misses == 1
@@ -0,0 +1,89 @@
+import functools
+import os
+
+import pytest
+from vtkmodules.vtkFiltersCore import vtkFeatureEdges, vtkFlyingEdges3D
+from vtkmodules.vtkFiltersGeneral import vtkDiscreteMarchingCubes
+from vtkmodules.vtkIOImage import vtkNIFTIImageReader
+
+from streamedSurface import StreamedSurface, read_slabs, slab_extents
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+SLAB_VOXELS = 192 * 256 * 40  # five slabs of the bundled volumes
+
+
+def open_reader(file_name):
+    reader = vtkNIFTIImageReader()
+    reader.SetFileName(os.path.join(DATA_DIR, file_name))
+    return reader
+
+
+def edges(poly_data, boundary=True, non_manifold=True):
+    feature_edges = vtkFeatureEdges()
+    feature_edges.SetInputData(poly_data)
+    feature_edges.SetBoundaryEdges(boundary)
+    feature_edges.SetNonManifoldEdges(non_manifold)
+    feature_edges.FeatureEdgesOff()
+    feature_edges.ManifoldEdgesOff()
+    feature_edges.Update()
+    return feature_edges.GetOutput().GetNumberOfCells()
+
+
+def whole_surface(file_name, discrete, value):
+    reader = open_reader(file_name)
+    contour = vtkDiscreteMarchingCubes() if discrete else vtkFlyingEdges3D()
+    contour.SetInputConnection(reader.GetOutputPort())
+    contour.SetValue(0, value)
+    contour.Update()
+    return contour.GetOutput()
+
+
+def streamed_surface(file_name, discrete, value, reduction):
+    surface = StreamedSurface(functools.partial(open_reader, file_name), discrete, SLAB_VOXELS, None, reduction)
+    surface.SetValue(0, value)
+    surface.Update()
+    return surface.GetOutput()
+
+
+def test_slab_extents_cover_the_volume():
+    extent = (0, 9, 0, 4, 0, 22)
+    shared = list(slab_extents(extent, 10 * 5 * 6))
+    assert [slab[4:] for slab in shared] == [[0, 5], [5, 10], [10, 15], [15, 20], [20, 22]]
+    separate = list(slab_extents(extent, 10 * 5 * 6, shared=False))
+    assert [slab[4:] for slab in separate] == [[0, 5], [6, 11], [12, 17], [18, 22]]
+    assert all(slab[:4] == [0, 9, 0, 4] for slab in shared + separate)
+
+
+def test_read_slabs_sees_every_voxel_once():
+    reader = open_reader('mask.nii.gz')
+    reader.Update()
+    whole = reader.GetOutput().GetPointData().GetScalars()
+    seen = 0
+    for image in read_slabs(open_reader('mask.nii.gz'), SLAB_VOXELS):
+        offset = image.GetExtent()[4] * 192 * 256
+        scalars = image.GetPointData().GetScalars()
+        assert all(scalars.GetTuple1(i) == whole.GetTuple1(offset + i) for i in range(0, scalars.GetNumberOfTuples(), 997))
+        seen += scalars.GetNumberOfTuples()
+    assert seen == whole.GetNumberOfTuples()
+
+
+# isovalues between voxel values, a voxel equal to it makes degenerate triangles that welding removes
+@pytest.mark.parametrize('file_name, discrete, value', [
+    ('T1.nii.gz', False, 400.5), ('T1.nii.gz', False, 150.25), ('mask.nii.gz', True, 3), ('mask.nii.gz', True, 5)])
+def test_welded_slabs_match_the_whole_volume(file_name, discrete, value):
+    streamed = streamed_surface(file_name, discrete, value, 0.0)
+    whole = whole_surface(file_name, discrete, value)
+
+    assert streamed.GetNumberOfCells() == whole.GetNumberOfCells()
+    assert streamed.GetNumberOfPoints() == whole.GetNumberOfPoints()
+    assert edges(streamed) == edges(whole)
+
+
+@pytest.mark.parametrize('file_name, discrete, value', [('T1.nii.gz', False, 400.5), ('mask.nii.gz', True, 3)])
+def test_decimated_slabs_leave_no_cracks(file_name, discrete, value):
+    # the cut boundary is kept while decimating, so neighbouring slabs still share every seam vertex
+    streamed = streamed_surface(file_name, discrete, value, 0.5)
+    whole = whole_surface(file_name, discrete, value)
+
+    assert streamed.GetNumberOfCells() < 0.6 * whole.GetNumberOfCells()
+    assert edges(streamed, non_manifold=False) == edges(whole, non_manifold=False)
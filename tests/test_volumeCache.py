@@ -0,0 +1,94 @@
+import gzip
+import os
+import shutil
+
+import pytest
+from vtkmodules.vtkCommonCore import VTK_FLOAT, VTK_SHORT, VTK_UNSIGNED_CHAR, VTK_UNSIGNED_SHORT
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkNIFTIImageReader, vtkNIFTIImageWriter
+
+from volumeCache import MappedNiftiReader, can_memory_map
+
+numpy = pytest.importorskip('numpy', reason='memory mapping needs numpy')
+from vtkmodules.util import numpy_support  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+
+
+def nifti_reader(file):
+    reader = vtkNIFTIImageReader()
+    reader.SetFileName(file)
+    return reader
+
+
+def voxels(image):
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+def inflate(file, directory):
+    path = os.path.join(str(directory), os.path.basename(file)[:-len('.gz')])
+    with gzip.open(file, 'rb') as src, open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return path
+
+
+def write_volume(file, scalar_type, version=1):
+    image = vtkImageData()
+    image.SetDimensions(11, 7, 5)
+    image.SetSpacing(0.5, 1.0, 2.5)
+    image.SetOrigin(-3.0, 4.0, 1.5)
+    image.AllocateScalars(scalar_type, 1)
+    values = voxels(image)
+    values[:] = numpy.arange(values.size) % 251
+    writer = vtkNIFTIImageWriter()
+    writer.SetNIFTIVersion(version)
+    writer.SetInputData(image)
+    writer.SetFileName(file)
+    writer.Write()
+    return file
+
+
+def assert_same_image(mapped, image):
+    assert mapped.GetExtent() == image.GetExtent()
+    assert mapped.GetSpacing() == pytest.approx(image.GetSpacing())
+    assert mapped.GetOrigin() == pytest.approx(image.GetOrigin())
+    assert voxels(mapped).dtype == voxels(image).dtype
+    assert numpy.array_equal(voxels(mapped), voxels(image))
+
+
+@pytest.mark.parametrize('file_name', ['T1.nii.gz', 'FLAIR.nii.gz', 'mask.nii.gz'])
+def test_mapped_reader_matches_vtk_reader(tmp_path, file_name):
+    file = inflate(os.path.join(DATA_DIR, file_name), tmp_path)
+    reader = nifti_reader(file)
+    assert can_memory_map(reader)
+    mapped = MappedNiftiReader(reader)
+    mapped.Update()
+    reader.Update()
+    assert_same_image(mapped.GetOutput(), reader.GetOutput())
+
+
+@pytest.mark.parametrize('scalar_type', [VTK_UNSIGNED_CHAR, VTK_SHORT, VTK_UNSIGNED_SHORT, VTK_FLOAT])
+@pytest.mark.parametrize('version', [1, 2])
+def test_mapped_reader_matches_written_volume(tmp_path, scalar_type, version):
+    reader = nifti_reader(write_volume(str(tmp_path / 'volume.nii'), scalar_type, version))
+    assert can_memory_map(reader)
+    mapped = MappedNiftiReader(reader)
+    mapped.Update()
+    reader.Update()
+    assert_same_image(mapped.GetOutput(), reader.GetOutput())
+
+
+def test_mapped_reader_serves_the_update_extent(tmp_path):
+    reader = nifti_reader(write_volume(str(tmp_path / 'volume.nii'), VTK_SHORT))
+    assert can_memory_map(reader)
+    mapped = MappedNiftiReader(reader)
+    mapped.UpdateExtent((2, 8, 1, 5, 3, 4))
+    reader.Update()
+    whole = voxels(reader.GetOutput()).reshape(5, 7, 11)
+
+    assert mapped.GetOutput().GetExtent() == (2, 8, 1, 5, 3, 4)
+    assert numpy.array_equal(voxels(mapped.GetOutput()), whole[3:5, 1:6, 2:9].ravel())
+
+
+def test_compressed_volumes_are_not_mapped():
+    assert not can_memory_map(nifti_reader(os.path.join(DATA_DIR, 'T1.nii.gz')))
@@ -0,0 +1,63 @@
+from volumeSession import VolumeSession
+
+
+def volume_files(tmp_path, count):
+    files = []
+    for index in range(count):
+        file = tmp_path / 'volume{}.nii'.format(index)
+        file.write_bytes(b'\0' * (index + 1))
+        files.append(str(file))
+    return files
+
+
+def loader(loaded):
+    def load(file):
+        loaded.append(file)
+        return {'file': file, 'bytes': 100}
+    return load
+
+
+def test_loads_each_file_once(tmp_path):
+    loaded = []
+    session = VolumeSession(1000, lambda entry: entry['bytes'])
+    brain, mask = volume_files(tmp_path, 2)
+    first = session.load('brain', brain, loader(loaded))
+    assert session.load('brain', brain, loader(loaded)) is first
+    session.load('mask', mask, loader(loaded))
+    session.load('brain', mask, loader(loaded))  # the same file as another kind is another entry
+
+    assert loaded == [brain, mask, mask]
+    assert session.stats() == {'hits': 1, 'misses': 3, 'entries': 3, 'bytes': 300}
+
+
+def test_drops_least_recently_used_past_the_budget(tmp_path):
+    loaded = []
+    session = VolumeSession(250, lambda entry: entry['bytes'])
+    files = volume_files(tmp_path, 3)
+    session.load('brain', files[0], loader(loaded))
+    session.load('brain', files[1], loader(loaded))
+    session.load('brain', files[0], loader(loaded))  # now the most recent
+    session.load('brain', files[2], loader(loaded))
+
+    assert [key[1] for key in session.entries] == [files[0], files[2]]
+    session.load('brain', files[1], loader(loaded))
+    assert loaded == [files[0], files[1], files[2], files[1]]
+
+
+def test_keeps_the_volumes_on_screen_over_budget(tmp_path):
+    session = VolumeSession(10, lambda entry: entry['bytes'])
+    brain, mask = volume_files(tmp_path, 2)
+    session.load('brain', brain, loader([]))
+    session.load('mask', mask, loader([]))
+    assert session.stats()['entries'] == 2
+
+
+def test_edited_file_is_loaded_again(tmp_path):
+    loaded = []
+    session = VolumeSession(1000, lambda entry: entry['bytes'])
+    brain, = volume_files(tmp_path, 1)
+    session.load('brain', brain, loader(loaded))
+    with open(brain, 'ab') as f:
+        f.write(b'\1')
+    session.load('brain', brain, loader(loaded))
+    assert loaded == [brain, brain]
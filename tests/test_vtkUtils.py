@@ -0,0 +1,215 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from vtkmodules.vtkCommonCore import VTK_FLOAT
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPiecewiseFunction
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+from vtkmodules.vtkImagingSources import vtkImageEllipsoidSource
+import vtkmodules.vtkRenderingOpenGL2  # noqa: F401
+from vtkmodules.vtkRenderingCore import (vtkColorTransferFunction, vtkImageSlice, vtkImageSliceMapper, vtkRenderer,
+                                         vtkRenderWindow, vtkVolumeProperty, vtkWindowToImageFilter)
+
+import vtkUtils
+from config import LOD_DIVISIONS, MASK_TRIANGLE_BUDGET, MAX_MESH_REDUCTION, MESH_REDUCTION, VOLUME_OPACITY_RAMP
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nifti_data')
+
+
+@pytest.fixture
+def no_mesh_cache():
+    # every surface is extracted, none comes from an earlier run
+    enabled = vtkUtils.mesh_cache.enabled
+    vtkUtils.mesh_cache.enabled = False
+    yield
+    vtkUtils.mesh_cache.enabled = enabled
+
+
+def sphere(resolution):
+    source = vtkSphereSource()
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution)
+    source.Update()
+    return source.GetOutput()
+
+
+def test_budget_water_filling():
+    shares = vtkUtils.allocate_triangle_budget({0: 100, 1: 5000, 2: 300, 3: 9000}, 6000)
+    assert shares[0] == 100 and shares[2] == 300  # below an equal share, kept whole
+    assert shares[1] == shares[3] == pytest.approx((6000 - 400) / 2)
+    assert sum(shares.values()) == pytest.approx(6000)
+    assert vtkUtils.allocate_triangle_budget({0: 10, 1: 20}, 1000) == {0: 10, 1: 20}
+
+
+def test_budget_reduction_bounds():
+    assert vtkUtils.budget_reduction(1000, None) == MESH_REDUCTION
+    assert vtkUtils.budget_reduction(1000, 900) == MESH_REDUCTION
+    assert vtkUtils.budget_reduction(1000, 100) == pytest.approx(0.9)
+    assert vtkUtils.budget_reduction(10 ** 6, 1) == MAX_MESH_REDUCTION
+
+
+def test_lod_meshes_get_coarser():
+    full = sphere(400)
+    counts = [mesh.GetNumberOfCells() for mesh in vtkUtils.create_lod_meshes(full)]
+    assert len(counts) == len(LOD_DIVISIONS)
+    assert full.GetNumberOfCells() > counts[0] > counts[-1] > 0
+    small = sphere(20)
+    assert all(mesh is small for mesh in vtkUtils.create_lod_meshes(small))
+
+
+def test_mask_labels_share_the_triangle_budget(no_mesh_cache):
+    mask = vtkUtils.load_mask(os.path.join(DATA_DIR, 'mask.nii.gz'), smoothness=20)
+    labels = [label for label in mask.labels if label.mapper]
+    total = sum(label.mapper.GetInput().GetNumberOfCells() for label in labels)
+    assert sum(label.triangle_budget for label in labels) == pytest.approx(MASK_TRIANGLE_BUDGET)
+    assert total <= 1.01 * MASK_TRIANGLE_BUDGET  # topology kept at the least reduction may overshoot a little
+    assert all(len(label.lod_mappers) == len(LOD_DIVISIONS) for label in labels)
+
+
+def ball_image(size=40):
+    # distance from the centre, its isosurfaces are spheres
+    source = vtkImageEllipsoidSource()
+    source.SetWholeExtent(0, size - 1, 0, size - 1, 0, size - 1)
+    source.SetCenter(size / 2, size / 2, size / 2)
+    source.SetRadius(size / 3, size / 4, size / 3.5)
+    source.SetOutputScalarTypeToUnsignedChar()
+    source.SetInValue(200)
+    source.SetOutValue(0)
+    source.Update()
+    return source.GetOutput()
+
+
+def run_stages(stages):
+    stages[-1].Update()
+    points = stages[-1].GetOutput().GetPoints().GetData()
+    return [points.GetComponent(point_idx, axis) for point_idx in range(points.GetNumberOfTuples()) for axis in range(3)]
+
+
+@pytest.mark.skipif(vtkUtils.SMOOTHER != 'laplacian', reason='only Laplacian smoothing continues from a checkpoint')
+def test_smoothing_continues_from_the_closest_checkpoint():
+    image = ball_image()
+    checkpoints = vtkUtils.SmoothingCheckpoints()
+    first = vtkUtils.create_surface_stages(image, 20, 100, checkpoints)
+    run_stages(first)
+    checkpoints.record(100, 20, first)
+
+    continued = vtkUtils.create_surface_stages(image, 50, 100, checkpoints)
+    assert len(continued) == 2  # smoother and normals on top of the 20 iteration mesh
+    assert continued[0].GetNumberOfIterations() == 30
+    fresh = vtkUtils.create_surface_stages(image, 50, 100)
+    assert run_stages(continued) == pytest.approx(run_stages(fresh), abs=1e-4)
+
+    checkpoints.record(100, 50, continued)
+    assert checkpoints.closest(100, 40)[0] == 20
+    assert checkpoints.closest(100, 10)[0] == 0  # the decimated mesh, smoothed from scratch
+    assert checkpoints.closest(101, 50) is None  # another isovalue, another decimated mesh
+
+
+def label_object(n_labels, streamed=False):
+    labels = [vtkUtils.NiiLabel((1.0, 1.0, 1.0), 1.0, 0) for _ in range(n_labels)]
+    for label in labels[1:]:
+        label.extractor = object()  # the first label has no voxels
+    return SimpleNamespace(labels=labels, streamed=streamed)
+
+
+def test_labels_run_side_by_side(monkeypatch):
+    monkeypatch.setattr(vtkUtils, 'PIPELINE_WORKERS', 3)
+    nii_object = label_object(4)
+    together = threading.Barrier(3, timeout=5)  # only passes when the three labels run at once
+    done = []
+
+    def work(label_idx):
+        together.wait()
+        done.append(label_idx)
+
+    vtkUtils.run_labels(nii_object, work)
+    assert sorted(done) == [1, 2, 3]
+    assert nii_object.labels[0].seconds == 0.0
+    assert all(label.seconds > 0 for label in nii_object.labels[1:])
+
+
+def test_streamed_labels_run_one_at_a_time(monkeypatch):
+    monkeypatch.setattr(vtkUtils, 'PIPELINE_WORKERS', 4)
+    threads = set()
+    vtkUtils.run_labels(label_object(4, streamed=True), lambda label_idx: threads.add(threading.get_ident()))
+    assert len(threads) == 1
+
+
+def test_label_error_is_raised():
+    def work(label_idx):
+        if label_idx == 2:
+            raise RuntimeError('label failed')
+
+    with pytest.raises(RuntimeError, match='label failed'):
+        vtkUtils.run_labels(label_object(4), work)
+
+
+def test_volume_transfer_follows_threshold_and_opacity():
+    volume_property = vtkVolumeProperty()
+    volume_property.SetScalarOpacity(vtkPiecewiseFunction())
+    volume_property.SetColor(vtkColorTransferFunction())
+    for threshold, opacity in ((100.0, 0.5), (300.0, 0.8)):  # moved again, the old points are gone
+        vtkUtils.set_volume_transfer(volume_property, (0.0, 1000.0), threshold, opacity, (1.0, 0.5, 0.0))
+        scalar_opacity = volume_property.GetScalarOpacity()
+        ramp_end = threshold + VOLUME_OPACITY_RAMP * 1000.0
+        assert scalar_opacity.GetSize() == 4
+        assert scalar_opacity.GetValue(threshold) == pytest.approx(0.0)
+        assert scalar_opacity.GetValue((threshold + ramp_end) / 2) == pytest.approx(opacity / 2)
+        assert scalar_opacity.GetValue(ramp_end) == pytest.approx(opacity)
+        assert scalar_opacity.GetValue(1000.0) == pytest.approx(opacity)
+        color_transfer = volume_property.GetRGBTransferFunction()
+        assert color_transfer.GetSize() == 3
+        assert color_transfer.GetColor(threshold) == pytest.approx((0.5, 0.25, 0.0))
+        assert color_transfer.GetColor(1000.0) == pytest.approx((1.0, 0.5, 0.0))
+
+
+def test_volume_opacity_ramp_stops_at_the_range():
+    volume_property = vtkVolumeProperty()
+    volume_property.SetScalarOpacity(vtkPiecewiseFunction())
+    volume_property.SetColor(vtkColorTransferFunction())
+    vtkUtils.set_volume_transfer(volume_property, (0.0, 1000.0), 999.0, 1.0, (1.0, 1.0, 1.0))
+    node = [0.0] * 4
+    volume_property.GetScalarOpacity().GetNodeValue(2, node)
+    assert node[0] == 1000.0
+
+
+def test_slices_follow_the_shared_lookup_table():
+    # needs an offscreen OpenGL window (e.g. VTK_DEFAULT_OPENGL_WINDOW=vtkEGLRenderWindow) without a display
+    image = vtkImageData()
+    image.SetDimensions(8, 8, 1)
+    image.AllocateScalars(VTK_FLOAT, 1)
+    image.GetPointData().GetScalars().Fill(25.0)
+    lut = vtkUtils.create_image_lut((0.0, 100.0))
+    image_prop = vtkUtils.create_image_property(lut)
+    image_prop.SetOpacity(1)
+    mapper = vtkImageSliceMapper()
+    mapper.SetInputData(image)
+    image_slice = vtkImageSlice()
+    image_slice.SetMapper(mapper)
+    image_slice.SetProperty(image_prop)
+    renderer = vtkRenderer()
+    renderer.AddViewProp(image_slice)
+    renderer.ResetCamera()
+    renderer.GetActiveCamera().Zoom(3)  # the slice fills the window
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(32, 32)
+    render_window.AddRenderer(renderer)
+
+    def shown_and_expected():
+        render_window.Render()
+        grabber = vtkWindowToImageFilter()
+        grabber.SetInput(render_window)
+        grabber.ReadFrontBufferOff()
+        grabber.Update()
+        color = [0.0] * 3
+        lut.GetColor(25.0, color)
+        return grabber.GetOutput().GetScalarComponentAsDouble(16, 16, 0, 0), round(255 * color[0])
+
+    shown, expected = shown_and_expected()
+    assert shown == pytest.approx(expected, abs=1)
+    lut.SetValueRange(0.0, 1.0)  # what the intensity control does, the mapper is left alone
+    lut.Build()
+    darker, expected = shown_and_expected()
+    assert darker == pytest.approx(expected, abs=1) and darker < shown
@@ -0,0 +1,155 @@
+import gzip
+import os
+import shutil
+import sys
+
+from vtkmodules.vtkCommonDataModel import vtkDataObject, vtkImageData
+from vtkmodules.vtkCommonExecutionModel import vtkStreamingDemandDrivenPipeline
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+from diskCache import DiskCache, file_hash
+
+try:
+    import numpy
+    from vtkmodules.util import numpy_support
+except ImportError:  # numpy is optional, volumes are then read by vtkNIFTIImageReader alone
+    numpy = None
+
+
+class VolumeCache(DiskCache):
+    """Keeps an inflated copy of every .nii.gz so gzip is only paid on the first load.
+
+    local_path() returns a plain .nii that the readers (or a memory map) can use
+    directly, uncompressed inputs are returned untouched.
+    """
+
+    def __init__(self, directory, max_bytes):
+        DiskCache.__init__(self, directory, max_bytes, '.nii')
+
+    def local_path(self, file):
+        if not self.enabled or not file.endswith('.gz'):
+            return file
+
+        path = self.path(file_hash(file))
+        if os.path.exists(path):
+            self.touch(path)
+            self.count(True)
+            return path
+
+        self.count(False)
+        tmp_path = self.tmp_path(os.path.basename(path))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with gzip.open(file, 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 22)
+            os.replace(tmp_path, path)
+        except (OSError, EOFError):
+            # no room, no write access or a broken archive, let the reader deal with the original
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return file
+        self.evict()
+        return path if os.path.exists(path) else file  # larger than the whole budget
+
+
+# NIfTI datatype code -> native numpy dtype
+NIFTI_DTYPES = {2: 'u1', 4: 'i2', 8: 'i4', 16: 'f4', 64: 'f8', 256: 'i1', 512: 'u2', 768: 'u4', 1024: 'i8', 1280: 'u8'}
+NIFTI_HEADER_SIZES = (348, 540)  # NIfTI-1, NIfTI-2
+
+
+def can_memory_map(reader):
+    # only layouts where the mapped bytes are exactly what vtkNIFTIImageReader would produce
+    file_name = reader.GetFileName()
+    if numpy is None or not file_name.endswith('.nii'):
+        return False
+    with open(file_name, 'rb') as f:
+        header_size = f.read(4)
+    if len(header_size) < 4 or int.from_bytes(header_size, sys.byteorder) not in NIFTI_HEADER_SIZES:
+        return False  # foreign byte order needs swapping
+    reader.UpdateInformation()
+    header = reader.GetNIFTIHeader()
+    return (header.GetDataType() in NIFTI_DTYPES and reader.GetQFac() >= 0 and
+            reader.GetTimeDimension() == 1 and reader.GetNumberOfScalarComponents() == 1)
+
+
+class MappedNiftiReader(VTKPythonAlgorithmBase):
+    """Serves the voxels of an uncompressed .nii straight from a memory map.
+
+    The header is still parsed by vtkNIFTIImageReader, only the voxel copy is
+    skipped, pages are loaded on first access and shared with the OS cache.
+    """
+
+    def __init__(self, header_reader):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkImageData')
+        self.header_reader = header_reader
+
+    def GetFileName(self):
+        return self.header_reader.GetFileName()
+
+    def GetDataExtent(self):
+        return self.header_reader.GetDataExtent()
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        info.CopyEntry(self.header_reader.GetOutputInformation(0), vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+        info.CopyEntry(self.header_reader.GetOutputInformation(0), vtkDataObject.SPACING())
+        info.CopyEntry(self.header_reader.GetOutputInformation(0), vtkDataObject.ORIGIN())
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        header = self.header_reader.GetNIFTIHeader()
+        x0, x1, y0, y1, z0, z1 = whole = self.GetDataExtent()
+        # copy-on-write so a filter writing to its input can never reach the file
+        voxels = numpy.memmap(self.GetFileName(), dtype=NIFTI_DTYPES[header.GetDataType()], mode='c',
+                              offset=int(header.GetVoxOffset()), shape=(z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1))
+
+        # only the requested extent, slabs of whole slices stay a view of the map
+        extent = outInfo.GetInformationObject(0).Get(vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
+        if extent is None or extent[1] < extent[0]:
+            extent = whole
+        voxels = numpy.ascontiguousarray(voxels[extent[4] - z0:extent[5] - z0 + 1, extent[2] - y0:extent[3] - y0 + 1,
+                                                extent[0] - x0:extent[1] - x0 + 1])
+        scalars = numpy_support.numpy_to_vtk(voxels.reshape(-1))  # no copy, keeps the map alive
+        scalars.SetName('NIFTI')
+
+        output = vtkImageData.GetData(outInfo)
+        output.SetExtent(extent)
+        output.SetSpacing(self.header_reader.GetOutputInformation(0).Get(vtkDataObject.SPACING()))
+        output.SetOrigin(self.header_reader.GetOutputInformation(0).Get(vtkDataObject.ORIGIN()))
+        output.GetPointData().SetScalars(scalars)
+        return 1
+
+
+class SharedVolume(VTKPythonAlgorithmBase):
+    """Source over a volume that was decoded once and is shared between pipelines.
+
+    Every pipeline gets its own SharedVolume, so pipelines updating on different
+    threads never run through the same executive, while the voxels are shared.
+    """
+
+    def __init__(self, reader):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkImageData')
+        self.reader = reader
+
+    def GetFileName(self):
+        return self.reader.GetFileName()
+
+    def GetDataExtent(self):
+        return self.reader.GetDataExtent()
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        info.CopyEntry(self.reader.GetOutputInformation(0), vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+        info.CopyEntry(self.reader.GetOutputInformation(0), vtkDataObject.SPACING())
+        info.CopyEntry(self.reader.GetOutputInformation(0), vtkDataObject.ORIGIN())
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        vtkImageData.GetData(outInfo).ShallowCopy(self.reader.GetOutputDataObject(0))
+        return 1
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+from config import *
+from niftiHeader import grid_mismatches, read_header
+
+
+class VolumeIndex:
+    """Small JSON sidecar of what a full read of a volume found out, its scalar range and label values.
+
+    Entries are keyed by path, size and modification time so an edited file is
+    looked at afresh. The next pairing of a known mask is checked against it
+    without touching the voxels.
+    """
+
+    def __init__(self, file, max_entries=1000):
+        self.file = file
+        self.max_entries = max_entries
+        self.entries = {}
+        self.stamp = None  # modification time of the file when it was read, other processes write it too
+        self.lock = threading.Lock()
+        self.enabled = True  # off, nothing is written and the entries on disk are still read
+
+    def key(self, volume_file):
+        stat = os.stat(volume_file)
+        return '{}|{}|{}'.format(os.path.abspath(volume_file), stat.st_size, stat.st_mtime_ns)
+
+    def load(self):
+        try:
+            stamp = os.stat(self.file).st_mtime_ns
+            if stamp != self.stamp:
+                with open(self.file) as f:
+                    self.entries = json.load(f)
+                self.stamp = stamp
+        except (OSError, ValueError):
+            pass
+
+    def get(self, volume_file):
+        try:
+            key = self.key(volume_file)
+        except OSError:
+            return None
+        with self.lock:
+            self.load()
+            return self.entries.get(key)
+
+    def put(self, volume_file, **facts):
+        if not self.enabled:
+            return
+        key = self.key(volume_file)
+        with self.lock:
+            self.load()
+            entry = self.entries.pop(key, {})
+            entry.update(facts)
+            self.entries[key] = entry  # latest last, the oldest are dropped first
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            try:
+                os.makedirs(os.path.dirname(self.file), exist_ok=True)
+                tmp_file = '{}.{}.tmp'.format(self.file, os.urandom(8).hex())
+                with open(tmp_file, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_file, self.file)
+            except OSError:
+                pass  # the index only saves time, loading goes on without it
+
+
+volume_index = VolumeIndex(VOLUME_INDEX_FILE)
+
+
+def pairing_problems(brain_file, mask_file):
+    """Reasons not to load mask_file over brain_file, from the two headers and the index only.
+
+    A mask not read before is only checked for its grid, load_mask skips a
+    volume with more than MASK_MAX_LABELS distinct values and indexes it for
+    next time. High label values alone are fine, atlases use them.
+
+    Raises ValueError when either file is not NIfTI.
+    """
+    brain = read_header(brain_file)
+    mask = read_header(mask_file)
+    problems = grid_mismatches(brain, mask)
+
+    facts = volume_index.get(mask_file)
+    if facts and 'scalar_range' in facts:
+        if int(facts['scalar_range'][1]) < 1 or facts.get('labels') == []:
+            problems.append('the mask has no labels')
+        elif facts.get('distinct', 0) > MASK_MAX_LABELS:
+            problems.append('the mask has more than {} distinct values, not a label map'.format(MASK_MAX_LABELS))
+    return problems
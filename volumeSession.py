@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class VolumeSession:
+    """Recently opened volumes kept loaded, least recently used are dropped past a byte budget.
+
+    Entries are keyed by kind ('brain' or 'mask') and file stamp, so an edited
+    file is loaded again. The most recent min_entries are never dropped, those
+    are the volumes on screen.
+    """
+
+    def __init__(self, max_bytes, size_of, min_entries=2):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.min_entries = min_entries
+        self.entries = OrderedDict()  # (kind, path, size, mtime) -> loaded object
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, file):
+        stat = os.stat(file)
+        return kind, os.path.abspath(file), stat.st_size, stat.st_mtime_ns
+
+    def load(self, kind, file, loader):
+        key = self.make_key(kind, file)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        loaded = loader(file)
+        with self.lock:
+            self.entries[key] = loaded
+            self.entries.move_to_end(key)
+            self.evict()
+        return loaded
+
+    def evict(self):
+        # sizes are taken again every time, meshes and preview copies grow while a volume is shown
+        sizes = {key: self.size_of(loaded) for key, loaded in self.entries.items()}
+        total = sum(sizes.values())
+        while total > self.max_bytes and len(self.entries) > self.min_entries:
+            key, _ = self.entries.popitem(last=False)
+            total -= sizes[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries),
+                    'bytes': sum(self.size_of(loaded) for loaded in self.entries.values())}